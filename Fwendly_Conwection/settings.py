@@ -80,6 +80,14 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Start every transaction with the write lock. SQLite can't upgrade a
+        # read to a write while another connection is writing and fails at
+        # once with "database is locked"; BEGIN IMMEDIATE waits for the lock
+        # (up to `timeout` seconds) instead.
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
@@ -128,6 +136,83 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'static', 'media_root')
 
+# Uploaded media is stored by content hash (see accounts/storage.py), so
+# identical files are kept once and their URLs never change.
+STORAGES = {
+    'default': {
+        'BACKEND': 'accounts.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Chunked, resumable uploads (accounts/uploads.py). Chunks are written to
+# CHUNKED_UPLOAD_TEMP_DIR and each request may carry at most CHUNK_SIZE bytes.
+
+CHUNKED_UPLOAD_TEMP_DIR = os.path.join(BASE_DIR, 'tmp', 'uploads')
+
+CHUNKED_UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+CHUNKED_UPLOAD_MAX_SIZE = {
+    'gallery': 20 * 1024 * 1024,
+    'cover_photo': 20 * 1024 * 1024,
+    'background_image': 20 * 1024 * 1024,
+    'music': 50 * 1024 * 1024,
+}
+
+# Batch gallery uploads (accounts/batch_upload.py). Files are validated and
+# stored by a pool of GALLERY_BATCH_WORKERS threads (None: one per CPU core).
+
+GALLERY_BATCH_MAX_FILES = 200
+
+GALLERY_BATCH_WORKERS = None
+
+# one over the form's limit, so an oversized batch gets the form's error
+# message rather than Django's bare 400
+DATA_UPLOAD_MAX_NUMBER_FILES = GALLERY_BATCH_MAX_FILES + 1
+
+# Friends activity feed (accounts/feed.py)
+
+FEED_MAX_ENTRIES = 200
+
+FEED_FANOUT_BATCH = 500
+
+# actors with more friends than this are read on demand instead of fanned out
+FEED_FANOUT_LIMIT = 1000
+
+BACKGROUND_TASK_WORKERS = 2
+
+# how long each user's friend id set stays cached (accounts/relationships.py)
+
+FRIENDS_CACHE_TIMEOUT = 300
+
+# The friendship cache must be shared by every worker process, otherwise one
+# worker never sees another's invalidations. Django's default LocMemCache is
+# per-process, which the accounts.W001 check warns about; in production point
+# the default cache at Redis or Memcached, e.g.
+#
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+#         'LOCATION': 'redis://127.0.0.1:6379',
+#     }
+# }
+#
+# A single-process development server can silence the check with
+# SILENCED_SYSTEM_CHECKS = ['accounts.W001'].
+
+# each process rebuilds its username autocomplete index this often
+# (accounts/autocomplete.py), refreshing other workers' changes and the
+# profile view counts used for ranking
+
+AUTOCOMPLETE_REBUILD_SECONDS = 600
+
+# Account deletion deletes dependent rows this many at a time, each batch in
+# its own short transaction (accounts/deletion.py)
+
+ACCOUNT_DELETION_BATCH_SIZE = 200
+
 # Default URLs for login and logout
 
 LOGIN_URL = 'accounts:login'
@@ -1,7 +1,8 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from accounts.views import serve_blob
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -9,5 +10,9 @@ urlpatterns = [
 ]
 
 if settings.DEBUG:
+    urlpatterns += [
+        re_path(r'^%s(?P<path>blobs/.*)$' % settings.MEDIA_URL.lstrip('/'), serve_blob,
+                {'document_root': settings.MEDIA_ROOT}),
+    ]
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Profile, FriendRequest, Testimonial, ProfileVisit, TopFive, Album, GalleryImage
+from .models import Profile, FriendRequest, Testimonial, ProfileVisit, TopFive, Album, GalleryImage, VisitSketch, MediaBlob, Activity, AccountDeletion
 
 admin.site.register(Profile)
 admin.site.register(FriendRequest)
@@ -8,3 +8,7 @@ admin.site.register(ProfileVisit)
 admin.site.register(TopFive)
 admin.site.register(Album)
 admin.site.register(GalleryImage)
+admin.site.register(VisitSketch)
+admin.site.register(MediaBlob)
+admin.site.register(Activity)
+admin.site.register(AccountDeletion)
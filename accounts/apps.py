@@ -7,3 +7,4 @@ class AccountsConfig(AppConfig):
     def ready(self):
         # import signals so profile is auto-created
         import accounts.signals  # noqa: F401
+        import accounts.checks  # noqa: F401
@@ -0,0 +1,201 @@
+"""
+In-memory username autocomplete.
+
+Usernames are kept lowercased in a sorted array, so every prefix match is a
+contiguous slice found with two bisections. Results are ranked by profile
+views; for short, popular prefixes whose slice is too big to scan on every
+keystroke the top entries are memoized until a username under that prefix
+changes. The index is built from the database in the background when the
+process starts serving requests (complete() queries the database until it is
+ready) and kept current by the User signals in accounts.signals. Each process keeps its own copy, so
+it is rebuilt in the background every AUTOCOMPLETE_REBUILD_SECONDS to pick up
+changes made by other processes (and changes racing the previous rebuild)
+along with current profile view counts.
+"""
+import bisect
+import heapq
+import sys
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.contrib.auth.models import User
+
+from .tasks import enqueue
+
+# slices up to this size are ranked directly; bigger ones use the memo
+SCAN_LIMIT = 2000
+MEMO_SIZE = 50
+_END = '\U0010ffff'
+
+
+class PrefixIndex:
+    def __init__(self, entries=()):
+        """entries: iterable of (user_id, username, weight)."""
+        rows = sorted((name.lower(), name, pk, weight) for pk, name, weight in entries)
+        self._keys = [key for key, _, _, _ in rows]
+        # share the string when the username is already lowercase
+        self._names = [key if name == key else name for key, name, _, _ in rows]
+        self._ids = array('q', (pk for _, _, pk, _ in rows))
+        self._weights = array('q', (w for _, _, _, w in rows))
+        self._memo = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _find(self, key, pk):
+        i = bisect.bisect_left(self._keys, key)
+        while i < len(self._keys) and self._keys[i] == key:
+            if self._ids[i] == pk:
+                return i
+            i += 1
+        return None
+
+    def _memoized(self, key):
+        return [key[:n] for n in range(1, len(key) + 1) if key[:n] in self._memo]
+
+    def add(self, pk, name, weight=0):
+        key = name.lower()
+        with self._lock:
+            i = bisect.bisect_right(self._keys, key)
+            self._keys.insert(i, key)
+            self._names.insert(i, key if name == key else name)
+            self._ids.insert(i, pk)
+            self._weights.insert(i, weight)
+            # keep memoized rankings current instead of rebuilding them
+            for prefix in self._memoized(key):
+                ranked = self._memo[prefix]
+                if len(ranked) < MEMO_SIZE or weight > ranked[-1][2]:
+                    ranked.append((pk, name, weight))
+                    ranked.sort(key=lambda r: r[2], reverse=True)
+                    del ranked[MEMO_SIZE:]
+
+    def remove(self, pk, name):
+        """Remove an entry, returning its weight (or None if it wasn't indexed)."""
+        key = name.lower()
+        with self._lock:
+            i = self._find(key, pk)
+            if i is None:
+                return None
+            weight = self._weights[i]
+            del self._keys[i], self._names[i], self._ids[i], self._weights[i]
+            for prefix in self._memoized(key):
+                if any(r[0] == pk for r in self._memo[prefix]):
+                    lo = bisect.bisect_left(self._keys, prefix)
+                    hi = bisect.bisect_left(self._keys, prefix + _END, lo)
+                    self._memo[prefix] = self._rank(lo, hi, MEMO_SIZE)
+            return weight
+
+    def _rank(self, lo, hi, limit):
+        best = heapq.nlargest(limit, range(lo, hi), key=self._weights.__getitem__)
+        return [(self._ids[i], self._names[i], self._weights[i]) for i in best]
+
+    def warm(self, max_length=3):
+        """Memoize rankings for every prefix too popular to rank per keystroke."""
+        with self._lock:
+            keys = self._keys
+            for n in range(1, max_length + 1):
+                i = 0
+                while i < len(keys):
+                    prefix = keys[i][:n]
+                    if len(prefix) < n:
+                        i += 1
+                        continue
+                    hi = bisect.bisect_left(keys, prefix + _END, i)
+                    if hi - i > SCAN_LIMIT:
+                        self._memo[prefix] = self._rank(i, hi, MEMO_SIZE)
+                    i = hi
+
+    def complete(self, prefix, limit=10):
+        """Up to limit (user_id, username) pairs starting with prefix, most viewed first."""
+        prefix = prefix.lower()
+        if not prefix:
+            return []
+        with self._lock:
+            lo = bisect.bisect_left(self._keys, prefix)
+            hi = bisect.bisect_left(self._keys, prefix + _END, lo)
+            if hi - lo <= SCAN_LIMIT or limit > MEMO_SIZE:
+                ranked = self._rank(lo, hi, limit)
+            else:
+                ranked = self._memo.get(prefix)
+                if ranked is None:
+                    ranked = self._memo[prefix] = self._rank(lo, hi, MEMO_SIZE)
+        return [(pk, name) for pk, name, _ in ranked[:limit]]
+
+    def memory_bytes(self):
+        """Approximate memory held by the index."""
+        with self._lock:
+            size = sys.getsizeof(self._keys) + sys.getsizeof(self._names)
+            size += sys.getsizeof(self._ids) + sys.getsizeof(self._weights)
+            size += sum(map(sys.getsizeof, self._keys))
+            size += sum(sys.getsizeof(n) for k, n in zip(self._keys, self._names) if n is not k)
+            size += sys.getsizeof(self._memo) + sum(sys.getsizeof(v) for v in self._memo.values())
+        return size
+
+
+_index = None
+_built_at = 0.0
+_rebuilding = False
+_build_lock = threading.Lock()
+
+
+def build_index():
+    rows = (
+        User.objects.filter(is_active=True)
+        .values_list('pk', 'username', 'profile__profile_views')
+        .iterator(chunk_size=10000)
+    )
+    index = PrefixIndex((pk, name, views or 0) for pk, name, views in rows)
+    index.warm()
+    return index
+
+
+def get_index():
+    """The index, or None while this process is still building it in the background."""
+    if _index is None or time.monotonic() - _built_at > settings.AUTOCOMPLETE_REBUILD_SECONDS:
+        _schedule_rebuild()
+    return _index
+
+
+def start_build(**kwargs):
+    # request_started receiver: start building as soon as the process serves
+    # traffic instead of making the first type-ahead request wait for it
+    if _index is None:
+        _schedule_rebuild()
+
+
+def complete(prefix, limit=10):
+    """(user_id, username) pairs starting with prefix, from the database until the index is built."""
+    index = get_index()
+    if index is not None:
+        return index.complete(prefix, limit)
+    return list(
+        User.objects.filter(is_active=True, username__istartswith=prefix)
+        .order_by('username').values_list('pk', 'username')[:limit]
+    )
+
+
+def _schedule_rebuild():
+    global _rebuilding
+    with _build_lock:
+        if _rebuilding:
+            return
+        _rebuilding = True
+    enqueue(rebuild)
+
+
+def rebuild():
+    """Swap in a freshly built index; requests keep using the old one meanwhile."""
+    global _index, _built_at, _rebuilding
+    try:
+        index = build_index()
+        _index, _built_at = index, time.monotonic()
+    finally:
+        _rebuilding = False
+
+
+def loaded_index():
+    """The index if this process has built it, else None (signals don't force a build)."""
+    return _index
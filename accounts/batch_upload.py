@@ -0,0 +1,95 @@
+"""
+Batch gallery uploads.
+
+Each file is validated (decoded by Pillow) and written to storage by a
+bounded thread pool; Pillow and hashlib release the GIL for the heavy
+parts, so throughput grows with the number of cores. All valid images are
+then inserted with a single bulk_create. bulk_create skips model signals,
+so the counter caches, album cover and activity feed are updated here in
+the same transaction instead.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connections, transaction
+
+from . import feed
+from .counters import bump
+from .models import Album, GalleryImage, Profile
+from .storage import release
+
+logger = logging.getLogger(__name__)
+
+
+def _store(profile, file):
+    """Validate and store one file; returns (unsaved GalleryImage, error)."""
+    try:
+        image = forms.ImageField().clean(file)
+        gi = GalleryImage(profile=profile)
+        gi.image.save(image.name, image, save=False)
+        return gi, None
+    except ValidationError as e:
+        return None, ' '.join(e.messages)
+    except Exception:
+        # an unreadable upload or a failed write only costs that one file
+        logger.exception("Storing gallery upload %s failed", getattr(file, 'name', ''))
+        return None, "This file could not be saved."
+    finally:
+        # storage bookkeeping may have opened a connection in this thread
+        connections.close_all()
+
+
+def _stored_names(futures):
+    names = []
+    for future in futures:
+        if future.done() and not future.cancelled() and future.exception() is None:
+            gi, _ = future.result()
+            if gi is not None:
+                names.append(gi.image.name)
+    return names
+
+
+def workers(count):
+    limit = settings.GALLERY_BATCH_WORKERS or os.cpu_count() or 1
+    return max(1, min(limit, count))
+
+
+def upload(profile, files, album=None, caption=''):
+    """Store files in the gallery, returning one result dict per file in order."""
+    futures = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers(len(files))) as pool:
+            futures = [pool.submit(_store, profile, f) for f in files]
+        stored = [f.result() for f in futures]
+
+        images = []
+        for gi, _ in stored:
+            if gi is not None:
+                gi.album = album
+                gi.caption = caption
+                images.append(gi)
+
+        if images:
+            with transaction.atomic():
+                created = GalleryImage.objects.bulk_create(images)
+                bump(Profile.objects.filter(pk=profile.pk), image_count=len(created))
+                if album is not None:
+                    bump(Album.objects.filter(pk=album.pk), image_count=len(created))
+                    Album.objects.filter(pk=album.pk, cover__isnull=True).update(cover=created[0])
+                summary = f"{len(created)} photos" + (f" to {album.name}" if album else '')
+                # attached to the first image so deleting it retracts the activity
+                feed.publish(profile.user, 'photos', created[0], summary=summary)
+    except BaseException:
+        # nothing was saved, so drop the references taken by every file stored so far
+        release(_stored_names(futures))
+        raise
+
+    return [
+        {'name': f.name, 'ok': gi is not None, 'error': error, 'image': gi}
+        for f, (gi, error) in zip(files, stored)
+    ]
+
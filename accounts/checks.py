@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+@register()
+def shared_cache_check(app_configs, **kwargs):
+    # relationships.invalidate() only reaches other workers through a shared cache
+    if settings.CACHES['default']['BACKEND'] in LOCAL_CACHES:
+        return [Warning(
+            "The default cache is not shared between processes, so cached friend lists go stale in other workers.",
+            hint="Point CACHES['default'] at a shared backend such as Redis or Memcached.",
+            id='accounts.W001',
+        )]
+    return []
@@ -0,0 +1,91 @@
+"""
+Counter cache helpers.
+
+Counts shown on profiles and albums are stored as denormalized columns and
+adjusted with F() expressions next to the write that changes them. The
+reconcile_* functions recompute them from the source tables in bulk and are
+used by the reconcile_counters management command to repair drift.
+"""
+from django.db.models import F, Func, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Profile, FriendRequest, Testimonial, Album, GalleryImage
+
+
+def bump(queryset, **deltas):
+    """Atomically add deltas to counter columns of every row in queryset, never going below zero."""
+    queryset.update(**{
+        field: Greatest(F(field) + delta, Value(0)) for field, delta in deltas.items()
+    })
+
+
+def first_image(album_ref='pk'):
+    return Subquery(
+        GalleryImage.objects.filter(album=OuterRef(album_ref)).order_by('pk').values('pk')[:1]
+    )
+
+
+def refresh_cover(album_id):
+    Album.objects.filter(pk=album_id, cover__isnull=True).update(cover=first_image())
+
+
+def _count(qs):
+    return Coalesce(
+        Subquery(qs.order_by().annotate(n=Func(F('pk'), function='COUNT')).values('n')[:1]),
+        Value(0),
+    )
+
+
+def profile_counters():
+    return {
+        'friend_count': _count(FriendRequest.objects.filter(
+            Q(from_user=OuterRef('user')) | Q(to_user=OuterRef('user')), accepted=True
+        )),
+        'testimonial_count': _count(Testimonial.objects.filter(profile=OuterRef('pk'))),
+        'image_count': _count(GalleryImage.objects.filter(profile=OuterRef('pk'))),
+    }
+
+
+def album_counters():
+    return {
+        'image_count': _count(GalleryImage.objects.filter(album=OuterRef('pk'))),
+        'cover': first_image(),
+    }
+
+
+def _unchanged(name):
+    match = Q(**{name: F(f'actual_{name}')})
+    # nullable columns (the album cover) also match when both sides are NULL
+    return match | Q(**{f'{name}__isnull': True, f'actual_{name}__isnull': True})
+
+
+def _reconcile(model, expressions, batch_size):
+    """Rewrite counters for rows whose stored values drifted, batch_size rows at a time."""
+    repaired = 0
+    last_pk = 0
+    while True:
+        batch = list(
+            model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not batch:
+            return repaired
+        last_pk = batch[-1]
+        unchanged = Q()
+        for name in expressions:
+            unchanged &= _unchanged(name)
+        drifted = list(
+            model.objects.filter(pk__in=batch)
+            .annotate(**{f'actual_{name}': expr for name, expr in expressions.items()})
+            .exclude(unchanged)
+            .values_list('pk', flat=True)
+        )
+        if drifted:
+            repaired += model.objects.filter(pk__in=drifted).update(**expressions)
+
+
+def reconcile_profiles(batch_size=500):
+    return _reconcile(Profile, profile_counters(), batch_size)
+
+
+def reconcile_albums(batch_size=500):
+    return _reconcile(Album, album_counters(), batch_size)
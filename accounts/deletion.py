@@ -0,0 +1,146 @@
+"""
+Background account deletion.
+
+Deleting a User in one go makes Django's collector load every dependent row
+and delete them all in a single transaction, which blocks SQLite writers for
+as long as it takes. Instead the account is disabled immediately and a job
+deletes the dependents in bounded batches, each in its own short
+transaction, recording progress on the AccountDeletion row as it goes.
+Signals still fire per batch, so counter caches, feeds and blob reference
+counts on other accounts stay correct. A write that can't get the SQLite
+lock is retried with backoff rather than failing the job. Jobs are
+idempotent and can be resumed with the process_account_deletions command.
+"""
+import os
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.db import OperationalError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import (
+    AccountDeletion, Profile, FriendRequest, Testimonial, ProfileVisit, TopFive,
+    Album, GalleryImage, VisitSketch, ChunkedUpload, Activity, FeedEntry,
+)
+from .relationships import friend_ids, invalidate
+from .storage import collect_garbage, is_blob, referenced_names
+from .tasks import enqueue
+
+# attempts per write, sleeping RETRY_DELAY, then twice that, ... in between
+RETRIES = 5
+RETRY_DELAY = 0.5
+
+
+def request_deletion(user):
+    """Disable user right away and schedule the deletion of everything they own."""
+    with transaction.atomic():
+        user.is_active = False
+        user.save(update_fields=['is_active'])
+        # friends' cached name lists drop the account now, not once the job runs
+        invalidate(*friend_ids(user.pk))
+        job, _ = AccountDeletion.objects.get_or_create(user_id=user.pk, defaults={'username': user.username})
+        enqueue(run, job.pk)
+    return job
+
+
+def steps(user_id, profile_id):
+    # (label, queryset, file field to remove afterwards), leaves first
+    return [
+        ('visits', ProfileVisit.objects.filter(Q(profile_id=profile_id) | Q(visitor_id=user_id)), None),
+        ('visit sketches', VisitSketch.objects.filter(profile_id=profile_id), None),
+        ('feed entries', FeedEntry.objects.filter(
+            Q(owner_id=user_id) | Q(activity__actor_id=user_id) | Q(activity__target_user_id=user_id)
+        ), None),
+        ('activities', Activity.objects.filter(Q(actor_id=user_id) | Q(target_user_id=user_id)), None),
+        ('testimonials', Testimonial.objects.filter(Q(profile_id=profile_id) | Q(author_id=user_id)), None),
+        ('gallery images', GalleryImage.objects.filter(profile_id=profile_id), 'image'),
+        ('albums', Album.objects.filter(profile_id=profile_id), None),
+        ('top fives', TopFive.objects.filter(profile_id=profile_id), None),
+        ('friend requests', FriendRequest.objects.filter(Q(from_user_id=user_id) | Q(to_user_id=user_id)), None),
+    ]
+
+
+def _retrying(func):
+    for attempt in range(RETRIES):
+        try:
+            return func()
+        except OperationalError:
+            # "database is locked": other writers held the lock past the busy timeout
+            if attempt == RETRIES - 1:
+                raise
+            time.sleep(RETRY_DELAY * 2 ** attempt)
+
+
+def _save_progress(job, **fields):
+    _retrying(lambda: AccountDeletion.objects.filter(pk=job.pk).update(progress=job.progress, **fields))
+
+
+def _delete_batches(job, label, queryset, file_field, batch_size, files):
+    done = job.progress.get(label, 0)
+    columns = ['pk'] + ([file_field] if file_field else [])
+    while True:
+        rows = list(queryset.order_by('pk').values_list(*columns)[:batch_size])
+        if not rows:
+            return
+        _retrying(lambda: _delete(queryset.model, [r[0] for r in rows]))
+        if file_field:
+            files.extend(r[1] for r in rows if r[1])
+        done += len(rows)
+        job.progress[label] = done
+        _save_progress(job)
+
+
+def _delete(model, pks):
+    with transaction.atomic():
+        model.objects.filter(pk__in=pks).delete()
+
+
+def remove_files(names):
+    # blobs are removed only once nothing else references them
+    collect_garbage(names=names)
+    for name in names:
+        if not is_blob(name) and default_storage.exists(name):
+            default_storage.delete(name)
+
+
+def run(job_id):
+    job = AccountDeletion.objects.filter(pk=job_id).exclude(status='done').first()
+    if job is None:
+        return
+    job.status = 'running'
+    _save_progress(job, status='running')
+    batch_size = settings.ACCOUNT_DELETION_BATCH_SIZE
+    try:
+        profile = Profile.objects.filter(user_id=job.user_id).first()
+        profile_id = profile.pk if profile else None
+        files = referenced_names(profile) if profile else []
+        files = [f for f in files if f]
+
+        for label, queryset, file_field in steps(job.user_id, profile_id):
+            _delete_batches(job, label, queryset, file_field, batch_size, files)
+
+        for upload in ChunkedUpload.objects.filter(user_id=job.user_id):
+            if os.path.exists(upload.temp_path()):
+                os.remove(upload.temp_path())
+        # only the rows themselves are left, so this is quick
+        _retrying(lambda: _delete(User, [job.user_id]))
+
+        job.progress['files'] = len(files)
+        _save_progress(job)
+        _retrying(lambda: remove_files(files))
+        _save_progress(job, status='done', finished_at=timezone.now())
+    except Exception as e:
+        _save_progress(job, status='failed', error=str(e))
+        raise
+
+
+def resume(include_failed=False):
+    """Run every unfinished job in this process; returns how many were run."""
+    statuses = ['pending', 'running'] + (['failed'] if include_failed else [])
+    jobs = list(AccountDeletion.objects.filter(status__in=statuses).values_list('pk', flat=True))
+    for pk in jobs:
+        run(pk)
+    return len(jobs)
@@ -0,0 +1,157 @@
+"""
+Friends activity feed.
+
+Events are written once as Activity rows and then fanned out on write: a
+background task copies a reference into each friend's FeedEntry timeline,
+batch by batch, and trims timelines back to FEED_MAX_ENTRIES. Reading a
+feed is then one indexed range scan over the owner's FeedEntry rows.
+
+Users with more than FEED_FANOUT_LIMIT friends are not fanned out to,
+whether they are the actor or the target of an activity; their friends pull
+those activities when reading instead.
+"""
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import Activity, FeedEntry, Profile, Testimonial
+from .privacy import can_view
+from .relationships import friend_ids, friends_q
+from .tasks import enqueue
+
+TRIM_SLACK = 20
+
+# which privacy setting (and whose) governs each kind of activity
+VERB_PRIVACY = {
+    'testimonial': ('target_user', 'testimonial_privacy'),
+    'photo': ('actor', 'gallery_privacy'),
+    'photos': ('actor', 'gallery_privacy'),
+    'album': ('actor', 'gallery_privacy'),
+}
+
+
+def publish(actor, verb, obj=None, target_user=None, summary=''):
+    activity = Activity.objects.create(
+        actor=actor,
+        verb=verb,
+        target_user=target_user,
+        content_type=ContentType.objects.get_for_model(obj) if obj is not None else None,
+        object_id=obj.pk if obj is not None else None,
+        summary=summary[:255],
+    )
+    enqueue(fan_out, activity.pk)
+    return activity
+
+
+def retract(obj):
+    """Remove the activities (and timeline entries) about a deleted object."""
+    Activity.objects.filter(
+        content_type=ContentType.objects.get_for_model(obj), object_id=obj.pk
+    ).delete()
+
+
+def recipients(activity, skip=()):
+    """Friends of the actor and target, leaving out the friends of users in skip."""
+    ids = set()
+    for party in (activity.actor_id, activity.target_user_id):
+        if party and party not in skip:
+            ids |= friend_ids(party)
+    ids -= {activity.actor_id, activity.target_user_id}
+    return sorted(ids)
+
+
+def fan_out(activity_id):
+    activity = Activity.objects.filter(pk=activity_id, delivery='pending').first()
+    if activity is None:
+        return
+    popular = set(
+        Profile.objects.filter(
+            user_id__in=[activity.actor_id, activity.target_user_id],
+            friend_count__gt=settings.FEED_FANOUT_LIMIT,
+        ).values_list('user_id', flat=True)
+    )
+
+    owners = recipients(activity, skip=popular)
+    batch_size = settings.FEED_FANOUT_BATCH
+    for start in range(0, len(owners), batch_size):
+        batch = owners[start:start + batch_size]
+        with transaction.atomic():
+            FeedEntry.objects.bulk_create(
+                [FeedEntry(owner_id=o, activity_id=activity.pk, created_at=activity.created_at) for o in batch],
+                ignore_conflicts=True,
+            )
+            trim(batch)
+    # the popular side's friends read the activity on demand
+    Activity.objects.filter(pk=activity_id).update(delivery='pull' if popular else 'pushed')
+
+
+def trim(owner_ids):
+    # one count query per batch; only timelines well past the cap are trimmed
+    limit = settings.FEED_MAX_ENTRIES
+    full = (
+        FeedEntry.objects.filter(owner_id__in=owner_ids)
+        .values('owner_id').annotate(n=Count('id')).filter(n__gt=limit + TRIM_SLACK)
+        .values_list('owner_id', flat=True)
+    )
+    for owner_id in full:
+        keep = FeedEntry.objects.filter(owner_id=owner_id).order_by('-created_at', '-id')
+        cutoff = keep.values_list('created_at', flat=True)[limit - 1]
+        FeedEntry.objects.filter(owner_id=owner_id, created_at__lt=cutoff).delete()
+
+
+def feed_for(user, limit=30):
+    """The newest activities from user's friends."""
+    entries = (
+        FeedEntry.objects.filter(owner=user)
+        .select_related('activity__actor__profile', 'activity__target_user__profile')
+        .order_by('-created_at')[:limit]
+    )
+    activities = [e.activity for e in entries]
+
+    celebrities = Profile.objects.filter(
+        friends_q(user.pk, 'user_id'), friend_count__gt=settings.FEED_FANOUT_LIMIT
+    ).values_list('user_id', flat=True)
+    # a friend of both sides may already have the activity on their timeline
+    seen = {a.pk for a in activities}
+    pulled = [
+        a for a in Activity.objects.filter(
+            Q(actor_id__in=celebrities) | Q(target_user_id__in=celebrities), delivery='pull'
+        ).exclude(actor=user).exclude(target_user=user)
+        .select_related('actor__profile', 'target_user__profile')[:limit]
+        if a.pk not in seen
+    ]
+    if pulled:
+        activities = sorted(activities + pulled, key=lambda a: a.created_at, reverse=True)[:limit]
+    hidden = hidden_testimonials(activities)
+    return [a for a in activities if visible(user, a, hidden)]
+
+
+def hidden_testimonials(activities):
+    ids = [a.object_id for a in activities if a.verb == 'testimonial']
+    if not ids:
+        return set()
+    return set(Testimonial.objects.filter(pk__in=ids, is_hidden=True).values_list('pk', flat=True))
+
+
+def visible(viewer, activity, hidden=()):
+    # privacy and hiding can change after fan-out, so both are checked when reading;
+    # hidden holds the pks of hidden testimonials, see hidden_testimonials()
+    if activity.verb == 'testimonial' and activity.object_id in hidden:
+        return False
+    if activity.verb not in VERB_PRIVACY:
+        return True
+    whose, field = VERB_PRIVACY[activity.verb]
+    return can_view(viewer, getattr(activity, whose).profile, field)
+
+
+def drain(batch_size=100):
+    """Fan out activities left pending, e.g. by a restart. Returns how many were processed."""
+    done = 0
+    while True:
+        pending = list(Activity.objects.filter(delivery='pending').order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pending:
+            return done
+        for pk in pending:
+            fan_out(pk)
+        done += len(pending)
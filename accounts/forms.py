@@ -1,7 +1,9 @@
 from django import forms
+from django.conf import settings
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
-from .models import Profile, Testimonial, TopFive, Album, GalleryImage
+from .themes import COLOR_RE
+from .models import Profile, Testimonial, TopFive, Album, GalleryImage, ChunkedUpload
 
 class RegisterForm(UserCreationForm):
     email = forms.EmailField(required=True)
@@ -31,6 +33,12 @@ class ProfileForm(forms.ModelForm):
             'profile_privacy', 'gallery_privacy', 'testimonial_privacy',
         ]
 
+    def clean_theme_color(self):
+        color = self.cleaned_data['theme_color']
+        if not COLOR_RE.match(color):
+            raise forms.ValidationError("Use a hex color like #ff66b2 or a color name.")
+        return color
+
 class TestimonialForm(forms.ModelForm):
     class Meta:
         model = Testimonial
@@ -50,3 +58,50 @@ class GalleryImageForm(forms.ModelForm):
     class Meta:
         model = GalleryImage
         fields = ['album', 'image', 'caption']
+
+class ChunkedUploadForm(forms.ModelForm):
+    class Meta:
+        model = ChunkedUpload
+        fields = ['target', 'filename', 'size', 'sha256', 'album', 'caption']
+
+    def clean_sha256(self):
+        digest = self.cleaned_data['sha256'].lower()
+        if len(digest) != 64 or any(c not in '0123456789abcdef' for c in digest):
+            raise forms.ValidationError("Expected a hex encoded SHA-256 digest.")
+        return digest
+
+    def clean(self):
+        cleaned = super().clean()
+        target, size = cleaned.get('target'), cleaned.get('size')
+        if target and size is not None:
+            limit = settings.CHUNKED_UPLOAD_MAX_SIZE[target]
+            if size > limit:
+                raise forms.ValidationError(f"File is too large (max {limit} bytes).")
+        return cleaned
+
+class MultipleFileInput(forms.ClearableFileInput):
+    allow_multiple_selected = True
+
+class MultipleFileField(forms.FileField):
+    # returns the list of uploaded files; each one is validated separately
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('widget', MultipleFileInput(attrs={'accept': 'image/*'}))
+        super().__init__(*args, **kwargs)
+
+    def to_python(self, data):
+        if not data:
+            return []
+        return list(data) if isinstance(data, (list, tuple)) else [data]
+
+    def clean(self, data, initial=None):
+        files = self.to_python(data)
+        if self.required and not files:
+            raise forms.ValidationError(self.error_messages['required'], code='required')
+        if len(files) > settings.GALLERY_BATCH_MAX_FILES:
+            raise forms.ValidationError(f"Upload at most {settings.GALLERY_BATCH_MAX_FILES} images at a time.")
+        return files
+
+class GalleryBatchUploadForm(forms.Form):
+    album = forms.ModelChoiceField(queryset=Album.objects.none(), required=False)
+    caption = forms.CharField(max_length=255, required=False)
+    images = MultipleFileField()
@@ -0,0 +1,73 @@
+"""
+Small HyperLogLog implementation used for unique visitor analytics.
+
+A sketch is a fixed array of 2**PRECISION one-byte registers, so each
+profile/day costs the same amount of storage no matter how many visits it
+received. Sketches for different days can be merged (register-wise max) to
+count distinct visitors over any date range.
+"""
+import hashlib
+import math
+
+PRECISION = 10
+REGISTERS = 1 << PRECISION
+_VALUE_BITS = 64 - PRECISION
+
+
+def _hash(value):
+    digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def _alpha(m):
+    if m == 16:
+        return 0.673
+    if m == 32:
+        return 0.697
+    if m == 64:
+        return 0.709
+    return 0.7213 / (1 + 1.079 / m)
+
+
+class HyperLogLog:
+    def __init__(self, registers=None):
+        if registers is None:
+            self.registers = bytearray(REGISTERS)
+        else:
+            if len(registers) != REGISTERS:
+                raise ValueError(f"Expected {REGISTERS} registers, got {len(registers)}")
+            self.registers = bytearray(registers)
+
+    def add(self, value):
+        """Add a value, returning True if the sketch changed."""
+        x = _hash(value)
+        index = x >> _VALUE_BITS
+        rest = x & ((1 << _VALUE_BITS) - 1)
+        rank = _VALUE_BITS - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        m = REGISTERS
+        estimate = _alpha(m) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        # small range correction: linear counting is far more accurate here
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+    @classmethod
+    def union(cls, sketches):
+        result = cls()
+        for s in sketches:
+            result.merge(s)
+        return result
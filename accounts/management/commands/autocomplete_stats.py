@@ -0,0 +1,45 @@
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.autocomplete import PrefixIndex, build_index
+
+
+class Command(BaseCommand):
+    help = "Build the username autocomplete index and report its size and query latency."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--synthetic', type=int, default=0,
+                            help="Benchmark a generated index of this many users instead of the database.")
+        parser.add_argument('--queries', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        started = time.perf_counter()
+        if options['synthetic']:
+            alphabet = string.ascii_lowercase + string.digits + '_'
+            index = PrefixIndex(
+                (pk, ''.join(rng.choices(alphabet, k=rng.randint(4, 14))), rng.randint(0, 10000))
+                for pk in range(1, options['synthetic'] + 1)
+            )
+            index.warm()
+        else:
+            index = build_index()
+        built = time.perf_counter() - started
+        self.stdout.write(f"Indexed {len(index)} users in {built:.2f}s")
+        if not len(index):
+            return
+
+        names = index._keys
+        prefixes = [rng.choice(names)[:rng.randint(1, 4)] for _ in range(options['queries'])]
+        timings = []
+        for prefix in prefixes:
+            t = time.perf_counter()
+            index.complete(prefix, 10)
+            timings.append(time.perf_counter() - t)
+        timings.sort()
+        ms = lambda q: timings[min(len(timings) - 1, int(q * len(timings)))] * 1000
+        self.stdout.write(f"Top-10 latency: p50 {ms(0.5):.3f} ms, p99 {ms(0.99):.3f} ms, max {ms(1):.3f} ms")
+        self.stdout.write(f"Memory: {index.memory_bytes() / 1024 / 1024:.1f} MiB")
@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from accounts.models import ChunkedUpload
+from accounts.uploads import discard
+
+
+class Command(BaseCommand):
+    help = "Discard chunked uploads that were abandoned before completion."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-hours', type=int, default=24)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['older_than_hours'])
+        count = 0
+        for upload in ChunkedUpload.objects.filter(created_at__lt=cutoff).iterator():
+            discard(upload)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Discarded {count} abandoned upload(s)."))
@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from accounts.storage import collect_garbage, recount
+
+
+class Command(BaseCommand):
+    help = "Delete content-addressed media blobs that are no longer referenced."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--grace-minutes', type=int, default=60,
+                            help="Keep blobs released more recently than this.")
+        parser.add_argument('--recount', action='store_true',
+                            help="Recompute reference counts from the database first.")
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            fixed = recount()
+            self.stdout.write(f"Corrected {fixed} reference count(s).")
+        removed = collect_garbage(
+            batch_size=options['batch_size'],
+            grace=timedelta(minutes=options['grace_minutes']),
+            dry_run=options['dry_run'],
+        )
+        verb = "Would remove" if options['dry_run'] else "Removed"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {removed} unreferenced blob(s)."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from accounts.feed import drain
+
+
+class Command(BaseCommand):
+    help = "Fan out activities that are still waiting to reach friends' timelines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        done = drain(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Fanned out {done} activit{'y' if done == 1 else 'ies'}."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from accounts.deletion import resume
+
+
+class Command(BaseCommand):
+    help = "Run account deletions that were interrupted or have not started yet (and, with --retry-failed, ones that failed)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true')
+
+    def handle(self, *args, **options):
+        count = resume(include_failed=options['retry_failed'])
+        self.stdout.write(self.style.SUCCESS(f"Processed {count} account deletion(s)."))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from accounts.counters import reconcile_profiles, reconcile_albums
+
+
+class Command(BaseCommand):
+    help = "Recompute profile and album counter caches, repairing any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        profiles = reconcile_profiles(batch_size)
+        albums = reconcile_albums(batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            f"Repaired {profiles} profile(s) and {albums} album(s)."
+        ))
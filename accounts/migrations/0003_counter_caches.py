@@ -0,0 +1,69 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, Func, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def _count(qs):
+    return Coalesce(
+        Subquery(qs.order_by().annotate(n=Func(F('pk'), function='COUNT')).values('n')[:1]),
+        Value(0),
+    )
+
+
+def backfill_counters(apps, schema_editor):
+    Profile = apps.get_model('accounts', 'Profile')
+    Album = apps.get_model('accounts', 'Album')
+    FriendRequest = apps.get_model('accounts', 'FriendRequest')
+    Testimonial = apps.get_model('accounts', 'Testimonial')
+    GalleryImage = apps.get_model('accounts', 'GalleryImage')
+
+    Profile.objects.update(
+        friend_count=_count(FriendRequest.objects.filter(
+            Q(from_user=OuterRef('user')) | Q(to_user=OuterRef('user')), accepted=True
+        )),
+        testimonial_count=_count(Testimonial.objects.filter(profile=OuterRef('pk'))),
+        image_count=_count(GalleryImage.objects.filter(profile=OuterRef('pk'))),
+    )
+    Album.objects.update(
+        image_count=_count(GalleryImage.objects.filter(album=OuterRef('pk'))),
+        cover=Subquery(GalleryImage.objects.filter(album=OuterRef('pk')).order_by('pk').values('pk')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_visitsketch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='cover',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='accounts.galleryimage'),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='image_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='friend_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='image_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='testimonial_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
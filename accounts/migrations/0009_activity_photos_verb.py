@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_accountdeletion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='activity',
+            name='verb',
+            field=models.CharField(choices=[('testimonial', 'wrote a testimonial for'), ('photo', 'added a photo'), ('photos', 'added photos'), ('album', 'created an album'), ('topfive', 'posted a Top 5'), ('friends', 'is now friends with')], max_length=20),
+        ),
+    ]
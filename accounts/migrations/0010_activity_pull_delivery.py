@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0009_activity_photos_verb'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='activity',
+            name='delivery',
+            field=models.CharField(choices=[('pending', 'Waiting for fan-out'), ('pushed', "Pushed to friends' timelines"), ('pull', "Read on demand by a popular user's friends")], default='pending', max_length=10),
+        ),
+    ]
@@ -1,6 +1,17 @@
-from django.db import models
+import os
+import uuid
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+
+from .hll import HyperLogLog
 
+# With accounts.storage.ContentAddressedStorage the final name is the file's
+# content hash; these paths only contribute the file extension.
 def profile_pic_upload(instance, filename):
     return f"profiles/{instance.user.username}/profile/{filename}"
 
@@ -13,6 +24,12 @@ def background_upload(instance, filename):
 def gallery_upload(instance, filename):
     return f"gallery/{instance.profile.user.username}/{filename}"
 
+def _fields_except(instance, excluded):
+    return [
+        f.name for f in instance._meta.concrete_fields
+        if not f.primary_key and f.name not in excluded
+    ]
+
 PRIVACY_CHOICES = [
     ("public", "Public"),
     ("friends", "Friends Only"),
@@ -44,9 +61,37 @@ class Profile(models.Model):
     gallery_privacy = models.CharField(max_length=10, choices=PRIVACY_CHOICES, default="public")
     testimonial_privacy = models.CharField(max_length=10, choices=PRIVACY_CHOICES, default="public")
 
+    # compiled from the theme fields by accounts.themes, shared by identical themes
+    theme_stylesheet = models.ForeignKey('ThemeStylesheet', related_name='profiles', on_delete=models.SET_NULL, null=True, blank=True, editable=False)
+
+    # counter caches, maintained by accounts.counters / accounts.signals
+    friend_count = models.PositiveIntegerField(default=0, editable=False)
+    testimonial_count = models.PositiveIntegerField(default=0, editable=False)
+    image_count = models.PositiveIntegerField(default=0, editable=False)
+
+    COUNTER_FIELDS = ('friend_count', 'testimonial_count', 'image_count')
+
+    # columns only ever changed through queryset updates
+    MANAGED_FIELDS = COUNTER_FIELDS + ('theme_stylesheet',)
+
+    def save(self, *args, **kwargs):
+        # never write managed columns back from a possibly stale instance
+        if not self._state.adding and not kwargs.get('update_fields') and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = _fields_except(self, self.MANAGED_FIELDS)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.user.username
 
+class ThemeStylesheet(models.Model):
+    # served at a URL containing its digest, so it can be cached forever
+    digest = models.CharField(max_length=32, unique=True)
+    css = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.digest
+
 class FriendRequest(models.Model):
     from_user = models.ForeignKey(User, related_name='sent_requests', on_delete=models.CASCADE)
     to_user = models.ForeignKey(User, related_name='received_requests', on_delete=models.CASCADE)
@@ -56,6 +101,17 @@ class FriendRequest(models.Model):
     class Meta:
         unique_together = ('from_user', 'to_user')
 
+    def accept(self):
+        """Mark the request accepted, returning False if it already was."""
+        with transaction.atomic():
+            if not FriendRequest.objects.filter(pk=self.pk, accepted=False).update(accepted=True):
+                return False
+            Profile.objects.filter(user_id__in=[self.from_user_id, self.to_user_id]).update(
+                friend_count=F('friend_count') + 1
+            )
+        self.accepted = True
+        return True
+
     def __str__(self):
         return f"{self.from_user.username} -> {self.to_user.username} ({'accepted' if self.accepted else 'pending'})"
 
@@ -80,6 +136,40 @@ class ProfileVisit(models.Model):
     def __str__(self):
         return f"{self.visitor.username} -> {self.profile.user.username} at {self.visited_at}"
 
+class VisitSketch(models.Model):
+    # one HyperLogLog sketch of distinct visitors per profile per day
+    profile = models.ForeignKey(Profile, related_name='visit_sketches', on_delete=models.CASCADE)
+    day = models.DateField()
+    registers = models.BinaryField(editable=False)
+
+    class Meta:
+        unique_together = ('profile', 'day')
+        ordering = ['-day']
+
+    def sketch(self):
+        return HyperLogLog(self.registers)
+
+    @classmethod
+    def record(cls, profile, visitor):
+        day = timezone.localdate()
+        with transaction.atomic():
+            row, _ = cls.objects.select_for_update().get_or_create(
+                profile=profile, day=day,
+                defaults={'registers': HyperLogLog().to_bytes()},
+            )
+            hll = row.sketch()
+            # repeat visitors usually leave the sketch untouched, so skip the write
+            if hll.add(visitor.pk):
+                cls.objects.filter(pk=row.pk).update(registers=hll.to_bytes())
+
+    @classmethod
+    def unique_visitors(cls, profile, start, end):
+        rows = cls.objects.filter(profile=profile, day__range=(start, end)).values_list('registers', flat=True)
+        return HyperLogLog.union(HyperLogLog(r) for r in rows).count()
+
+    def __str__(self):
+        return f"Visitors of {self.profile.user.username} on {self.day}"
+
 class TopFive(models.Model):
     CATEGORIES = [
         ("movies", "Movies"),
@@ -106,6 +196,17 @@ class Album(models.Model):
     name = models.CharField(max_length=100)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # counter cache and cover image, maintained by accounts.signals
+    image_count = models.PositiveIntegerField(default=0, editable=False)
+    cover = models.ForeignKey('GalleryImage', related_name='+', on_delete=models.SET_NULL, null=True, blank=True, editable=False)
+
+    COUNTER_FIELDS = ('image_count', 'cover')
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not kwargs.get('update_fields') and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = _fields_except(self, self.COUNTER_FIELDS)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.name} ({self.profile.user.username})"
 
@@ -118,3 +219,109 @@ class GalleryImage(models.Model):
 
     def __str__(self):
         return f"Image by {self.profile.user.username} ({self.caption})"
+
+class MediaBlob(models.Model):
+    # a content-addressed file in accounts.storage, shared by every field that references it
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    released_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} refs)"
+
+class ChunkedUpload(models.Model):
+    # a resumable upload in progress; chunks are appended to temp_path()
+    TARGETS = [
+        ("gallery", "Gallery image"),
+        ("music", "Profile music"),
+        ("cover_photo", "Cover photo"),
+        ("background_image", "Background image"),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, related_name='chunked_uploads', on_delete=models.CASCADE)
+    target = models.CharField(max_length=20, choices=TARGETS)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    sha256 = models.CharField(max_length=64)
+    offset = models.PositiveBigIntegerField(default=0)
+    album = models.ForeignKey(Album, on_delete=models.SET_NULL, null=True, blank=True)
+    caption = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def temp_path(self):
+        return os.path.join(settings.CHUNKED_UPLOAD_TEMP_DIR, f"{self.pk}.part")
+
+    def max_size(self):
+        return settings.CHUNKED_UPLOAD_MAX_SIZE[self.target]
+
+    def __str__(self):
+        return f"{self.filename} by {self.user.username} ({self.offset}/{self.size})"
+
+class Activity(models.Model):
+    VERBS = [
+        ("testimonial", "wrote a testimonial for"),
+        ("photo", "added a photo"),
+        ("photos", "added photos"),
+        ("album", "created an album"),
+        ("topfive", "posted a Top 5"),
+        ("friends", "is now friends with"),
+    ]
+    DELIVERY = [
+        ("pending", "Waiting for fan-out"),
+        ("pushed", "Pushed to friends' timelines"),
+        ("pull", "Read on demand by a popular user's friends"),
+    ]
+    actor = models.ForeignKey(User, related_name='activities', on_delete=models.CASCADE)
+    verb = models.CharField(max_length=20, choices=VERBS)
+    target_user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE, null=True, blank=True)
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, null=True, blank=True)
+    object_id = models.PositiveBigIntegerField(null=True, blank=True)
+    summary = models.CharField(max_length=255, blank=True)
+    delivery = models.CharField(max_length=10, choices=DELIVERY, default="pending")
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['actor', '-created_at']),
+            models.Index(fields=['content_type', 'object_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.actor.username} {self.get_verb_display()}"
+
+class FeedEntry(models.Model):
+    # one row per recipient, capped at FEED_MAX_ENTRIES per owner by accounts.feed
+    owner = models.ForeignKey(User, related_name='feed_entries', on_delete=models.CASCADE)
+    activity = models.ForeignKey(Activity, related_name='feed_entries', on_delete=models.CASCADE)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('owner', 'activity')
+        indexes = [models.Index(fields=['owner', '-created_at'])]
+
+    def __str__(self):
+        return f"{self.activity} (for {self.owner.username})"
+
+class AccountDeletion(models.Model):
+    # background job deleting a disabled account in batches (accounts.deletion)
+    STATUSES = [
+        ("pending", "Pending"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # not a ForeignKey: the user row is the last thing the job deletes
+    user_id = models.PositiveBigIntegerField(unique=True)
+    username = models.CharField(max_length=150)
+    status = models.CharField(max_length=10, choices=STATUSES, default="pending")
+    progress = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    requested_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Deletion of {self.username} ({self.status})"
@@ -0,0 +1,40 @@
+"""
+Privacy checks for the profile, gallery and testimonial sections.
+
+can_view() answers for a single profile with a cached relationship lookup.
+visible_q()/visible_users() filter whole User querysets in SQL with a
+friendship subquery, so lists never check privacy row by row and the query
+stays the same size however many friends the viewer has.
+"""
+from django.db.models import BooleanField, ExpressionWrapper, Q
+
+from .relationships import friends_of, friends_q
+
+
+def can_view(viewer, profile, field='profile_privacy'):
+    level = getattr(profile, field)
+    if viewer.is_authenticated and viewer.pk == profile.user_id:
+        return True
+    if level == 'public':
+        return True
+    if level == 'friends':
+        return viewer.is_authenticated and profile.user_id in friends_of(viewer)
+    return False
+
+
+def visible_q(viewer, field='profile_privacy', prefix=''):
+    """Q matching users whose `field` section viewer may see. prefix points at a User relation."""
+    lookup = f'{prefix}profile__{field}'
+    allowed = Q(**{lookup: 'public'})
+    if viewer.is_authenticated:
+        allowed |= Q(**{f'{prefix}pk': viewer.pk})
+        allowed |= Q(**{lookup: 'friends'}) & friends_q(viewer.pk, f'{prefix}pk')
+    return allowed
+
+
+def visible_users(viewer, users, field='profile_privacy'):
+    return users.filter(visible_q(viewer, field))
+
+
+def annotate_visible(viewer, users, field='profile_privacy', name='profile_visible'):
+    return users.annotate(**{name: ExpressionWrapper(visible_q(viewer, field), output_field=BooleanField())})
@@ -0,0 +1,72 @@
+"""
+Friendship lookups.
+
+Each user's set of friend ids is loaded with one query and kept in the
+shared cache, so every worker sees invalidations. friends_of() additionally
+memoises the set on a user object, so a request reads it from the cache once
+however many checks it makes. List filtering uses friends_q() to stay in SQL.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from .models import FriendRequest
+
+
+def _key(user_id):
+    return f"accounts:friends:{user_id}"
+
+
+def _names_key(user_id):
+    return f"accounts:friend-names:{user_id}"
+
+
+def friend_ids(user_id):
+    """Ids of everyone user_id has an accepted friendship with. Don't mutate the result."""
+    ids = cache.get(_key(user_id))
+    if ids is None:
+        rows = FriendRequest.objects.filter(
+            Q(from_user_id=user_id) | Q(to_user_id=user_id), accepted=True
+        ).values_list('from_user_id', 'to_user_id')
+        ids = frozenset(b if a == user_id else a for a, b in rows)
+        cache.set(_key(user_id), ids, settings.FRIENDS_CACHE_TIMEOUT)
+    return ids
+
+
+def friends_of(user):
+    """friend_ids() for a user object, memoised on it (request.user lives for one request)."""
+    try:
+        return user._friend_ids
+    except AttributeError:
+        user._friend_ids = friend_ids(user.pk)
+        return user._friend_ids
+
+
+def friends_q(user_id, field='pk'):
+    """Q matching rows whose `field` is a friend of user_id, as subqueries rather than a list of ids."""
+    sent = FriendRequest.objects.filter(from_user_id=user_id, accepted=True).values('to_user_id')
+    received = FriendRequest.objects.filter(to_user_id=user_id, accepted=True).values('from_user_id')
+    return Q(**{f'{field}__in': sent}) | Q(**{f'{field}__in': received})
+
+
+def are_friends(user_id, other_id):
+    return other_id in friend_ids(user_id)
+
+
+def friend_usernames(user_id):
+    """{id: username} for user_id's active friends, cached like friend_ids()."""
+    names = cache.get(_names_key(user_id))
+    if names is None:
+        friends = User.objects.filter(pk__in=friend_ids(user_id), is_active=True)
+        names = dict(friends.values_list('pk', 'username'))
+        cache.set(_names_key(user_id), names, settings.FRIENDS_CACHE_TIMEOUT)
+    return names
+
+
+def invalidate(*user_ids):
+    keys = [_key(u) for u in user_ids] + [_names_key(u) for u in user_ids]
+    cache.delete_many(keys)
+    # and again once committed, in case someone re-cached the old state meanwhile
+    transaction.on_commit(lambda: cache.delete_many(keys))
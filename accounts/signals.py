@@ -1,7 +1,13 @@
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.core.signals import request_started
+from django.db.models.signals import post_init, pre_save, post_save, post_delete
 from django.dispatch import receiver
-from .models import Profile
+from .models import Profile, FriendRequest, Testimonial, TopFive, Album, GalleryImage
+from . import feed
+from .autocomplete import loaded_index, start_build
+from .relationships import invalidate
+from .counters import bump, refresh_cover
+from .storage import REFERENCING_FIELDS, referenced_names, release
 
 @receiver(post_save, sender=User)
 def create_profile(sender, instance, created, **kwargs):
@@ -11,3 +17,121 @@ def create_profile(sender, instance, created, **kwargs):
 @receiver(post_save, sender=User)
 def save_profile(sender, instance, **kwargs):
     instance.profile.save()
+
+
+# Username autocomplete index, updated incrementally.
+INDEXED_USER_FIELDS = {'username', 'is_active'}
+
+def _touches_index(update_fields):
+    return update_fields is None or bool(INDEXED_USER_FIELDS & set(update_fields))
+
+@receiver(pre_save, sender=User)
+def remember_username(sender, instance, update_fields=None, **kwargs):
+    if loaded_index() is not None and instance.pk and _touches_index(update_fields):
+        instance._indexed_username = User.objects.filter(pk=instance.pk).values_list('username', flat=True).first()
+
+@receiver(post_save, sender=User)
+def index_user(sender, instance, created, update_fields=None, **kwargs):
+    index = loaded_index()
+    if index is None or not _touches_index(update_fields):
+        return
+    weight = 0
+    old = getattr(instance, '_indexed_username', None)
+    if old is not None:
+        weight = index.remove(instance.pk, old) or 0
+    if instance.is_active:
+        index.add(instance.pk, instance.username, weight)
+
+@receiver(post_delete, sender=User)
+def unindex_user(sender, instance, **kwargs):
+    index = loaded_index()
+    if index is not None:
+        index.remove(instance.pk, instance.username)
+
+request_started.connect(start_build)
+
+
+# Counter caches. These run inside the caller's transaction, so the views
+# wrap the underlying insert/delete in transaction.atomic().
+@receiver(post_save, sender=Testimonial)
+def testimonial_created(sender, instance, created, **kwargs):
+    if created:
+        bump(Profile.objects.filter(pk=instance.profile_id), testimonial_count=1)
+
+@receiver(post_delete, sender=Testimonial)
+def testimonial_deleted(sender, instance, **kwargs):
+    bump(Profile.objects.filter(pk=instance.profile_id), testimonial_count=-1)
+
+@receiver(post_save, sender=GalleryImage)
+def gallery_image_created(sender, instance, created, **kwargs):
+    if created:
+        bump(Profile.objects.filter(pk=instance.profile_id), image_count=1)
+        if instance.album_id:
+            bump(Album.objects.filter(pk=instance.album_id), image_count=1)
+            Album.objects.filter(pk=instance.album_id, cover__isnull=True).update(cover=instance)
+
+@receiver(post_delete, sender=GalleryImage)
+def gallery_image_deleted(sender, instance, **kwargs):
+    bump(Profile.objects.filter(pk=instance.profile_id), image_count=-1)
+    if instance.album_id:
+        bump(Album.objects.filter(pk=instance.album_id), image_count=-1)
+        # the cover FK was nulled by the delete if it pointed at this image
+        refresh_cover(instance.album_id)
+
+@receiver(post_delete, sender=FriendRequest)
+def friend_request_deleted(sender, instance, **kwargs):
+    if instance.accepted:
+        bump(Profile.objects.filter(user_id__in=[instance.from_user_id, instance.to_user_id]), friend_count=-1)
+        invalidate(instance.from_user_id, instance.to_user_id)
+
+
+# Media blob references. Remember the file names a row was loaded with so
+# replacing or clearing a file releases the old blob.
+def remember_files(sender, instance, **kwargs):
+    if instance.get_deferred_fields() & set(REFERENCING_FIELDS[sender]):
+        # don't trigger a query per row for .only()/.defer() querysets
+        instance._loaded_files = None
+    else:
+        instance._loaded_files = referenced_names(instance)
+
+def release_replaced_files(sender, instance, created, **kwargs):
+    current = referenced_names(instance)
+    previous = getattr(instance, '_loaded_files', None) or []
+    release([old for old, new in zip(previous, current) if old != new])
+    instance._loaded_files = current
+
+def release_deleted_files(sender, instance, **kwargs):
+    release(referenced_names(instance))
+
+for model in REFERENCING_FIELDS:
+    post_init.connect(remember_files, sender=model)
+    post_save.connect(release_replaced_files, sender=model)
+    post_delete.connect(release_deleted_files, sender=model)
+
+
+# Activity feed. publish() defers the fan-out until the transaction commits.
+@receiver(post_save, sender=Testimonial)
+def publish_testimonial(sender, instance, created, **kwargs):
+    if created:
+        feed.publish(instance.author, 'testimonial', instance, target_user=instance.profile.user, summary=instance.content)
+
+@receiver(post_save, sender=GalleryImage)
+def publish_gallery_image(sender, instance, created, **kwargs):
+    if created:
+        feed.publish(instance.profile.user, 'photo', instance, summary=instance.caption)
+
+@receiver(post_save, sender=Album)
+def publish_album(sender, instance, created, **kwargs):
+    if created:
+        feed.publish(instance.profile.user, 'album', instance, summary=instance.name)
+
+@receiver(post_save, sender=TopFive)
+def publish_topfive(sender, instance, created, **kwargs):
+    if created:
+        feed.publish(instance.profile.user, 'topfive', instance, summary=instance.title)
+
+def retract_activities(sender, instance, **kwargs):
+    feed.retract(instance)
+
+for model in (Testimonial, GalleryImage, Album, TopFive, FriendRequest):
+    post_delete.connect(retract_activities, sender=model)
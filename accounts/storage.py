@@ -0,0 +1,160 @@
+"""
+Content-addressed media storage.
+
+Uploaded files are stored under the SHA-256 of their contents
+(``blobs/ab/cd/abcd....jpg``), so identical uploads share one file on disk
+and every URL is immutable. A MediaBlob row tracks how many model fields
+reference each blob; the collect_media_garbage command removes blobs nobody
+references any more.
+"""
+import hashlib
+import os
+import uuid
+from collections import Counter, defaultdict
+
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+from .models import MediaBlob, Profile, GalleryImage
+
+BLOB_PREFIX = 'blobs/'
+
+# every model field whose files live in the blob store
+REFERENCING_FIELDS = {
+    Profile: ['profile_pic', 'cover_photo', 'background_image', 'music'],
+    GalleryImage: ['image'],
+}
+
+
+def content_hash(content):
+    sha = hashlib.sha256()
+    for chunk in content.chunks():
+        sha.update(chunk)
+    return sha.hexdigest()
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(BLOB_PREFIX)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def _save(self, name, content):
+        # chunked uploads already verified their digest, so don't read the file again
+        digest = getattr(content, 'sha256', None) or content_hash(content)
+        ext = os.path.splitext(name)[1].lower()
+        blob_name = f"{BLOB_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+        # take the reference first so a concurrent garbage collection skips this blob.
+        # A new row means any file still on disk is one garbage collection is
+        # about to delete, so write the content again rather than trusting it.
+        if acquire(blob_name, content.size) or not self.exists(blob_name):
+            content.seek(0)
+            try:
+                self._write(blob_name, content)
+            except BaseException:
+                release([blob_name])
+                raise
+        return blob_name
+
+    def _write(self, name, content):
+        # write beside the blob and rename over it, so readers never see a partial file
+        tmp_name = super()._save(f"{name}.{uuid.uuid4().hex}.tmp", content)
+        os.replace(self.path(tmp_name), self.path(name))
+
+
+def acquire(name, size=0):
+    """Take a reference to a blob, returning True if its row had to be created."""
+    if MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + 1, released_at=None):
+        return False
+    try:
+        with transaction.atomic():
+            MediaBlob.objects.create(name=name, size=size, refcount=1)
+        return True
+    except IntegrityError:
+        MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + 1, released_at=None)
+        return False
+
+
+def release(names):
+    # a blob can be referenced more than once (say as both profile and cover
+    # picture), so drop one reference per occurrence, grouping names by count
+    by_count = defaultdict(list)
+    for name, n in Counter(n for n in names if is_blob(n)).items():
+        by_count[n].append(name)
+    for n, group in by_count.items():
+        MediaBlob.objects.filter(name__in=group).update(
+            refcount=Greatest(F('refcount') - n, Value(0)),
+            released_at=timezone.now(),
+        )
+
+
+def referenced_names(instance):
+    return [getattr(instance, f).name for f in REFERENCING_FIELDS[type(instance)]]
+
+
+def recount(batch_size=1000):
+    """Recompute every blob's refcount from the model fields that point at it."""
+    counts = {}
+    for model, fields in REFERENCING_FIELDS.items():
+        for row in model.objects.values_list(*fields).iterator(chunk_size=batch_size):
+            for name in row:
+                if is_blob(name):
+                    counts[name] = counts.get(name, 0) + 1
+
+    stale = []
+    now = timezone.now()
+    for blob in MediaBlob.objects.only('pk', 'name', 'refcount', 'released_at').iterator(chunk_size=batch_size):
+        actual = counts.pop(blob.name, 0)
+        if blob.refcount != actual:
+            blob.refcount = actual
+            # the reference may belong to a row that isn't committed yet, so
+            # dropping to zero starts the grace period like release() does
+            blob.released_at = now if actual == 0 else None
+            stale.append(blob)
+    MediaBlob.objects.bulk_update(stale, ['refcount', 'released_at'], batch_size=batch_size)
+    # referenced blobs that are missing a row
+    MediaBlob.objects.bulk_create(
+        [MediaBlob(name=name, refcount=n) for name, n in counts.items()],
+        batch_size=batch_size, ignore_conflicts=True,
+    )
+    return len(stale) + len(counts)
+
+
+def collect_garbage(batch_size=100, grace=None, dry_run=False, storage=None, names=None):
+    """
+    Delete unreferenced blobs batch_size at a time and return how many were
+    removed. Blobs released (or, if never released, created) less than
+    ``grace`` ago are kept; ``names`` limits collection to the given blobs.
+    """
+    storage = storage or default_storage
+    candidates = MediaBlob.objects.filter(refcount=0)
+    if names is not None:
+        candidates = candidates.filter(name__in=[n for n in names if is_blob(n)])
+    if grace is not None:
+        # blobs never released (say, stored but not yet saved on a model) age from creation
+        cutoff = timezone.now() - grace
+        candidates = candidates.filter(
+            models.Q(released_at__isnull=True, created_at__lte=cutoff) | models.Q(released_at__lte=cutoff)
+        )
+    removed = 0
+    last_pk = 0
+    while True:
+        batch = list(candidates.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'name')[:batch_size])
+        if not batch:
+            return removed
+        last_pk = batch[-1][0]
+        if dry_run:
+            removed += len(batch)
+            continue
+        for pk, name in batch:
+            # deleting the row locks it until commit, so an upload of the same
+            # content waits and then recreates the row and rewrites the file
+            with transaction.atomic():
+                deleted, _ = MediaBlob.objects.filter(pk=pk, refcount=0).delete()
+                if deleted:
+                    storage.delete(name)
+                    removed += 1
@@ -0,0 +1,34 @@
+"""
+Minimal background task runner.
+
+Work is handed to a small thread pool once the surrounding transaction
+commits, so it never runs on the request path and never sees uncommitted
+rows. Jobs should be resumable from the database (see the fanout_activities
+and process_account_deletions commands) in case the process exits first.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'BACKGROUND_TASK_WORKERS', 2),
+    thread_name_prefix='accounts-tasks',
+)
+
+
+def _run(func, args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception("Background task %s failed", func.__name__)
+    finally:
+        connections.close_all()
+
+
+def enqueue(func, *args):
+    """Run func(*args) in the background after the current transaction commits."""
+    transaction.on_commit(lambda: _executor.submit(_run, func, args))
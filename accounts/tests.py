@@ -1,3 +1,529 @@
-from django.test import TestCase
+import datetime
+import hashlib
+from datetime import timedelta
+import io
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import autocomplete, batch_upload, deletion, feed, storage
+from .checks import shared_cache_check
+from .hll import HyperLogLog
+from .privacy import visible_users
+from .relationships import friend_usernames, friends_of
+from .models import (
+    Activity, ChunkedUpload, FeedEntry, FriendRequest, GalleryImage, MediaBlob, Profile, Testimonial,
+    VisitSketch,
+)
+
+
+class TempMediaMixin:
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class MediaTestCase(TempMediaMixin, TestCase):
+    pass
+
+
+class ContentAddressedStorageTests(MediaTestCase):
+    def test_new_row_rewrites_file_left_behind(self):
+        content = b'picture'
+        name = default_storage.save('a.jpg', ContentFile(content))
+        # garbage collection deleted the row but hasn't removed the file yet
+        MediaBlob.objects.filter(name=name).delete()
+        with default_storage.open(name, 'wb') as f:
+            f.write(b'partial')
+
+        self.assertEqual(default_storage.save('b.jpg', ContentFile(content)), name)
+        with default_storage.open(name) as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 1)
+
+    def test_collect_garbage_removes_row_and_file(self):
+        name = default_storage.save('a.jpg', ContentFile(b'picture'))
+        storage.release([name])
+
+        self.assertEqual(storage.collect_garbage(), 1)
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+        self.assertFalse(default_storage.exists(name))
+
+
+    def test_recount_to_zero_starts_the_grace_period(self):
+        # stored by a batch upload whose GalleryImage rows aren't committed yet
+        name = default_storage.save('a.jpg', ContentFile(b'picture'))
+        MediaBlob.objects.filter(name=name).update(created_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(storage.recount(), 1)
+        blob = MediaBlob.objects.get(name=name)
+        self.assertEqual(blob.refcount, 0)
+        self.assertIsNotNone(blob.released_at)
+
+        self.assertEqual(storage.collect_garbage(grace=timedelta(hours=1)), 0)
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(storage.collect_garbage(grace=timedelta(0)), 1)
+
+    def test_never_released_blob_ages_from_creation(self):
+        name = default_storage.save('a.jpg', ContentFile(b'picture'))
+        MediaBlob.objects.filter(name=name).update(refcount=0)
+        self.assertEqual(storage.collect_garbage(grace=timedelta(hours=1)), 0)
+        MediaBlob.objects.filter(name=name).update(created_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(storage.collect_garbage(grace=timedelta(hours=1)), 1)
+
+
+class RefcountTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.profile = User.objects.create_user('alice').profile
+        self.profile.profile_pic.save('pic.jpg', ContentFile(b'picture'), save=False)
+        self.profile.cover_photo.save('cover.jpg', ContentFile(b'picture'), save=False)
+        self.profile.save()
+        self.name = self.profile.profile_pic.name
+
+    def refcount(self):
+        return MediaBlob.objects.get(name=self.name).refcount
+
+    def test_same_blob_in_two_fields_counts_twice(self):
+        self.assertEqual(self.profile.cover_photo.name, self.name)
+        self.assertEqual(self.refcount(), 2)
+
+    def test_clearing_both_fields_releases_both_references(self):
+        self.profile.profile_pic = None
+        self.profile.cover_photo = None
+        self.profile.save()
+        self.assertEqual(self.refcount(), 0)
+
+    def test_clearing_one_field_keeps_the_blob(self):
+        self.profile.cover_photo = None
+        self.profile.save()
+        self.assertEqual(self.refcount(), 1)
+        self.assertEqual(storage.collect_garbage(), 0)
+        self.assertTrue(default_storage.exists(self.name))
+
+    def test_deleting_profile_releases_every_reference(self):
+        self.profile.delete()
+        self.assertEqual(self.refcount(), 0)
+        self.assertEqual(storage.collect_garbage(), 1)
+
+    def test_release_groups_names_by_count(self):
+        other = default_storage.save('other.jpg', ContentFile(b'other'))
+        storage.release([self.name, other, self.name, 'not-a-blob.jpg'])
+        self.assertEqual(self.refcount(), 0)
+        self.assertEqual(MediaBlob.objects.get(name=other).refcount, 0)
+
+
+# relationship tests clear the cache, so they get one of their own
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'accounts-tests'}}
+
+
+def befriend(a, b):
+    FriendRequest.objects.create(from_user=a, to_user=b).accept()
+
+
+@override_settings(FEED_FANOUT_LIMIT=2, CACHES=TEST_CACHES)
+class FeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        names = ['alice', 'bob', 'carol', 'dave', 'erin']
+        self.alice, self.bob, self.carol, self.dave, self.erin = [
+            User.objects.create_user(n) for n in names
+        ]
+        befriend(self.alice, self.carol)
+        # bob is over the fan-out limit
+        for friend in (self.alice, self.dave, self.erin):
+            befriend(self.bob, friend)
+
+    def write_testimonial(self):
+        Testimonial.objects.create(profile=self.bob.profile, author=self.alice, content='hi')
+        activity = Activity.objects.get(verb='testimonial')
+        feed.fan_out(activity.pk)
+        activity.refresh_from_db()
+        return activity
+
+    def test_popular_target_is_pulled_not_pushed(self):
+        activity = self.write_testimonial()
+        self.assertEqual(activity.delivery, 'pull')
+        self.assertEqual(
+            set(FeedEntry.objects.filter(activity=activity).values_list('owner_id', flat=True)),
+            {self.carol.pk},
+        )
+        self.assertEqual(feed.feed_for(self.dave), [activity])
+        self.assertEqual(feed.feed_for(self.carol), [activity])
+        self.assertEqual(feed.feed_for(self.alice), [])
+
+    def test_friend_of_both_sides_sees_activity_once(self):
+        befriend(self.carol, self.bob)
+        activity = self.write_testimonial()
+        self.assertEqual(feed.feed_for(self.carol), [activity])
+
+    def test_hidden_testimonial_drops_out_of_feed(self):
+        activity = self.write_testimonial()
+        Testimonial.objects.update(is_hidden=True)
+        self.assertEqual(feed.feed_for(self.carol), [])
+        self.assertEqual(feed.feed_for(self.dave), [])
+        Testimonial.objects.update(is_hidden=False)
+        self.assertEqual(feed.feed_for(self.carol), [activity])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RelationshipCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_friends_of_reads_the_cache_once_per_user_object(self):
+        alice, bob = User.objects.create_user('alice'), User.objects.create_user('bob')
+        befriend(alice, bob)
+        self.assertEqual(friends_of(alice), {bob.pk})
+        cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(friends_of(alice), {bob.pk})
+
+    def test_per_process_cache_is_reported(self):
+        self.assertEqual([w.id for w in shared_cache_check(None)], ['accounts.W001'])
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://'}}
+        with override_settings(CACHES=redis):
+            self.assertEqual(shared_cache_check(None), [])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PrivacyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_friends_only_profiles_visible_to_friends(self):
+        alice, bob, carol = [User.objects.create_user(n) for n in ('alice', 'bob', 'carol')]
+        befriend(bob, alice)
+        for user in (bob, carol):
+            user.profile.profile_privacy = 'friends'
+            user.profile.save()
+        visible = visible_users(alice, User.objects.order_by('username'))
+        self.assertEqual(list(visible), [alice, bob])
+        # the friend set is a subquery, not a literal list of ids
+        self.assertIn('accounts_friendrequest', str(visible.query))
+
+
+class AutocompleteRebuildTests(TestCase):
+    def setUp(self):
+        for name, value in (('_index', None), ('_built_at', 0.0), ('_rebuilding', False)):
+            setattr(autocomplete, name, value)
+            self.addCleanup(setattr, autocomplete, name, value)
+        self.alice, self.alan = User.objects.create_user('alice'), User.objects.create_user('alan')
+
+    def names(self):
+        return [name for _, name in autocomplete.complete('al')]
+
+    def test_rebuild_picks_up_unsignalled_changes_and_weights(self):
+        autocomplete.rebuild()
+        self.assertEqual(sorted(self.names()), ['alan', 'alice'])
+        # as if done by another process: no signals reach this index
+        User.objects.filter(pk=self.alan.pk).update(is_active=False)
+        Profile.objects.filter(user=self.alice).update(profile_views=5)
+        User.objects.bulk_create([User(username='albert')])
+        Profile.objects.create(user=User.objects.get(username='albert'), profile_views=1)
+        self.assertEqual(sorted(self.names()), ['alan', 'alice'])
+
+        autocomplete.rebuild()
+        self.assertEqual(self.names(), ['alice', 'albert'])
+
+    def test_queries_database_while_index_builds_in_background(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual([name for _, name in autocomplete.complete('AL')], ['alan', 'alice'])
+            autocomplete.start_build()
+        self.assertIsNone(autocomplete.loaded_index())
+        self.assertEqual(len(callbacks), 1)
+
+    def test_first_request_starts_the_build(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.get('/login/')
+        self.assertEqual(len(callbacks), 1)
+
+    @override_settings(AUTOCOMPLETE_REBUILD_SECONDS=0)
+    def test_stale_index_schedules_one_rebuild(self):
+        autocomplete.rebuild()
+        with self.captureOnCommitCallbacks() as callbacks:
+            autocomplete.get_index()
+            autocomplete.get_index()
+        self.assertEqual(len(callbacks), 1)
+
+
+def png(name, color):
+    buf = io.BytesIO()
+    Image.new('RGB', (4, 4), color).save(buf, 'PNG')
+    return SimpleUploadedFile(name, buf.getvalue(), content_type='image/png')
+
+
+# files are stored from worker threads, which need to see committed rows
+class BatchUploadTests(TempMediaMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.profile = User.objects.create_user('alice').profile
+        # fan-out threads would race the test's own writes for the database
+        enqueue = mock.patch('accounts.feed.enqueue')
+        enqueue.start()
+        self.addCleanup(enqueue.stop)
+
+    def test_unexpected_error_only_fails_that_file(self):
+        real_write = storage.ContentAddressedStorage._write
+
+        def write(self, name, content):
+            if content.name == 'bad.png':
+                raise OSError('disk full')
+            return real_write(self, name, content)
+
+        with mock.patch.object(storage.ContentAddressedStorage, '_write', write), \
+                self.assertLogs('accounts.batch_upload', 'ERROR'):
+            results = batch_upload.upload(self.profile, [png('good.png', 'red'), png('bad.png', 'blue')])
+
+        self.assertEqual([r['ok'] for r in results], [True, False])
+        self.assertEqual(results[1]['error'], "This file could not be saved.")
+        self.assertEqual(self.profile.gallery.count(), 1)
+        # the failed write gave its reference back
+        self.assertEqual(MediaBlob.objects.filter(refcount__gt=0).count(), 1)
+
+    def test_failed_insert_releases_every_stored_file(self):
+        files = [png('a.png', 'red'), png('b.png', 'blue'), png('c.txt', 'green')]
+        with mock.patch('accounts.models.GalleryImage.objects.bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                batch_upload.upload(self.profile, files)
+        self.assertEqual(MediaBlob.objects.count(), 2)
+        self.assertFalse(MediaBlob.objects.filter(refcount__gt=0).exists())
+
+    def test_batch_activity_is_retracted_with_its_first_image(self):
+        results = batch_upload.upload(self.profile, [png('a.png', 'red'), png('b.png', 'blue')])
+        activity = Activity.objects.get(verb='photos')
+        self.assertEqual(activity.object_id, results[0]['image'].pk)
+        results[0]['image'].delete()
+        self.assertFalse(Activity.objects.filter(pk=activity.pk).exists())
+
+    def test_too_many_files_gets_the_form_error(self):
+        self.client.force_login(self.profile.user)
+        files = [SimpleUploadedFile(f'{i}.png', b'') for i in range(settings.GALLERY_BATCH_MAX_FILES + 1)]
+        response = self.client.post(reverse('accounts:add_gallery_images_batch'), {'images': files})
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(
+            response.context['form'], 'images',
+            f"Upload at most {settings.GALLERY_BATCH_MAX_FILES} images at a time.",
+        )
+        self.assertFalse(self.profile.gallery.exists())
+
+
+class HyperLogLogTests(TestCase):
+    def sketch(self, values):
+        hll = HyperLogLog()
+        for v in values:
+            hll.add(v)
+        return hll
+
+    def assertEstimate(self, hll, expected, tolerance):
+        self.assertAlmostEqual(hll.count(), expected, delta=expected * tolerance)
+
+    def test_small_counts_are_near_exact(self):
+        self.assertEqual(HyperLogLog().count(), 0)
+        self.assertEqual(self.sketch(range(10)).count(), 10)
+
+    def test_large_counts_within_error_bound(self):
+        # standard error is 1.04 / sqrt(1024), about 3%
+        self.assertEstimate(self.sketch(range(50000)), 50000, 0.1)
+
+    def test_repeats_do_not_change_the_sketch(self):
+        hll = self.sketch(range(100))
+        self.assertFalse(any(hll.add(v) for v in range(100)))
+
+    def test_merge_counts_the_union(self):
+        a, b = self.sketch(range(0, 6000)), self.sketch(range(4000, 10000))
+        self.assertEstimate(HyperLogLog.union([a, b]), 10000, 0.1)
+        self.assertEqual(HyperLogLog(a.to_bytes()).merge(b).to_bytes(), HyperLogLog.union([a, b]).to_bytes())
+
+    def test_rejects_wrong_register_count(self):
+        with self.assertRaises(ValueError):
+            HyperLogLog(b'\0' * 10)
+
+
+class VisitSketchTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner')
+        self.visitors = [User.objects.create_user(f'v{i}') for i in range(5)]
+
+    def test_unique_visitors_across_days(self):
+        today = datetime.date(2026, 1, 2)
+        with mock.patch('django.utils.timezone.localdate', return_value=today - datetime.timedelta(days=1)):
+            for v in self.visitors[:3]:
+                VisitSketch.record(self.owner.profile, v)
+        with mock.patch('django.utils.timezone.localdate', return_value=today):
+            for v in self.visitors[2:] + self.visitors[2:]:
+                VisitSketch.record(self.owner.profile, v)
+        self.assertEqual(VisitSketch.unique_visitors(self.owner.profile, today, today), 3)
+        self.assertEqual(VisitSketch.unique_visitors(self.owner.profile, today - datetime.timedelta(days=1), today), 5)
+
+    def test_failed_sketch_update_does_not_break_profile_page(self):
+        self.client.force_login(self.visitors[0])
+        with mock.patch.object(VisitSketch, 'record', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('accounts.views', 'ERROR'):
+            response = self.client.get(f'/u/{self.owner.username}/')
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(ACCOUNT_DELETION_BATCH_SIZE=2, CACHES=TEST_CACHES)
+class AccountDeletionTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.victim, self.other = User.objects.create_user('victim'), User.objects.create_user('other')
+        befriend(self.victim, self.other)
+        for i in range(3):
+            Testimonial.objects.create(profile=self.other.profile, author=self.victim, content=str(i))
+        Testimonial.objects.create(profile=self.victim.profile, author=self.other, content='hi')
+        for i, color in enumerate(('red', 'green', 'blue')):
+            GalleryImage.objects.create(profile=self.victim.profile, image=png(f'{i}.png', color))
+        # the same picture in other's gallery keeps its blob alive
+        GalleryImage.objects.create(profile=self.other.profile, image=png('mine.png', 'red'))
+        self.names = list(GalleryImage.objects.filter(profile__user=self.victim).values_list('image', flat=True))
+
+    def delete_victim(self):
+        with mock.patch('accounts.deletion.enqueue'):
+            job = deletion.request_deletion(self.victim)
+        deletion.run(job.pk)
+        job.refresh_from_db()
+        return job
+
+    def test_disabled_account_drops_out_of_friend_lists(self):
+        self.assertEqual(friend_usernames(self.other.pk), {self.victim.pk: 'victim'})
+        with mock.patch('accounts.deletion.enqueue'):
+            deletion.request_deletion(self.victim)
+        self.assertEqual(friend_usernames(self.other.pk), {})
+
+    def test_job_deletes_in_batches_and_fixes_counters(self):
+        job = self.delete_victim()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.progress['testimonials'], 4)
+        self.assertEqual(job.progress['gallery images'], 3)
+        self.assertFalse(User.objects.filter(pk=self.victim.pk).exists())
+        self.assertFalse(Testimonial.objects.filter(author_id=self.victim.pk).exists())
+        profile = Profile.objects.get(user=self.other)
+        self.assertEqual((profile.friend_count, profile.testimonial_count, profile.image_count), (0, 0, 1))
+
+    def test_job_removes_files_nothing_else_references(self):
+        shared = GalleryImage.objects.get(profile__user=self.other).image.name
+        self.delete_victim()
+        for name in self.names:
+            self.assertEqual(default_storage.exists(name), name == shared)
+            self.assertEqual(MediaBlob.objects.filter(name=name).exists(), name == shared)
+        self.assertEqual(MediaBlob.objects.get(name=shared).refcount, 1)
+
+    def test_locked_batch_is_retried(self):
+        real_delete = deletion._delete
+        calls = []
+
+        def delete(model, pks):
+            calls.append(model)
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+            return real_delete(model, pks)
+
+        with mock.patch.object(deletion, '_delete', delete), mock.patch('time.sleep'):
+            job = self.delete_victim()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(calls[0], calls[1])
+
+
+def png_bytes(color, size=(4, 4)):
+    buf = io.BytesIO()
+    Image.new('RGB', size, color).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+class ChunkedUploadTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir, ignore_errors=True)
+        settings_override = override_settings(CHUNKED_UPLOAD_TEMP_DIR=temp_dir, CHUNKED_UPLOAD_CHUNK_SIZE=64)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user('alice')
+        self.client.force_login(self.user)
+        self.data = png_bytes('red', (40, 40))
+
+    def start(self, target='gallery', data=None, sha256=None):
+        data = self.data if data is None else data
+        response = self.client.post('/uploads/', {
+            'target': target, 'filename': 'pic.png', 'size': len(data),
+            'sha256': sha256 or hashlib.sha256(data).hexdigest(),
+        })
+        self.assertEqual(response.status_code, 201)
+        return f"/uploads/{response.json()['id']}/"
+
+    def put(self, url, offset, chunk, **extra):
+        return self.client.put(url, chunk, content_type='application/octet-stream',
+                               HTTP_UPLOAD_OFFSET=str(offset), **extra)
+
+    def send_all(self, url, data=None):
+        data = self.data if data is None else data
+        for offset in range(0, len(data), 64):
+            self.assertEqual(self.put(url, offset, data[offset:offset + 64]).status_code, 200)
+
+    def test_offset_mismatch_returns_server_offset(self):
+        url = self.start()
+        self.put(url, 0, self.data[:64])
+        response = self.put(url, 0, self.data[:64])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 64)
+
+    def test_oversize_chunk_is_rejected(self):
+        url = self.start()
+        self.assertEqual(self.put(url, 0, self.data[:65]).status_code, 413)
+        self.assertEqual(self.client.get(url).json()['offset'], 0)
+
+    def test_missing_content_length(self):
+        url = self.start()
+        self.assertEqual(self.put(url, 0, self.data[:64], CONTENT_LENGTH='').status_code, 411)
+
+    def test_incomplete_upload_cannot_complete(self):
+        url = self.start()
+        self.put(url, 0, self.data[:64])
+        self.assertEqual(self.client.post(url + 'complete/').status_code, 409)
+
+    def test_checksum_mismatch_discards_upload(self):
+        url = self.start(sha256=hashlib.sha256(b'other').hexdigest())
+        self.send_all(url)
+        self.assertEqual(self.client.post(url + 'complete/').status_code, 422)
+        self.assertFalse(ChunkedUpload.objects.exists())
+
+    def test_complete_gallery_image(self):
+        url = self.start()
+        self.send_all(url)
+        response = self.client.post(url + 'complete/')
+        self.assertEqual(response.status_code, 200)
+        image = GalleryImage.objects.get(profile=self.user.profile)
+        self.assertEqual(response.json()['url'], image.image.url)
+        with image.image.open() as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertFalse(ChunkedUpload.objects.exists())
+
+    def test_complete_profile_field(self):
+        url = self.start(target='cover_photo')
+        self.send_all(url)
+        self.assertEqual(self.client.post(url + 'complete/').status_code, 200)
+        profile = Profile.objects.get(user=self.user)
+        with profile.cover_photo.open() as f:
+            self.assertEqual(f.read(), self.data)
@@ -0,0 +1,69 @@
+"""
+Per-profile theme stylesheets.
+
+A profile's theme fields are compiled into a small stylesheet that is stored
+once per distinct result and served from a URL containing its content hash,
+so browsers can cache it forever and identical themes share one file.
+"""
+import hashlib
+import re
+
+from .models import Profile, ThemeStylesheet
+
+THEME_FIELDS = ('theme_choice', 'theme_color', 'font_choice', 'background_image')
+
+COLOR_RE = re.compile(r'^(#[0-9a-fA-F]{3,8}|[a-zA-Z]{1,20})$')
+
+DEFAULT_COLOR = '#ffffff'
+
+FONTS = {
+    'default': "'Segoe UI', Tahoma, Geneva, Verdana, sans-serif",
+    'comic': "'Comic Sans MS', cursive, sans-serif",
+    'arial': "Arial, sans-serif",
+    'times': "'Times New Roman', Times, serif",
+    'courier': "'Courier New', Courier, monospace",
+}
+
+THEMES = {
+    'default': "",
+    'dark': ".profile-page .card { background: #17181a; color: #e6e6e6; }\n",
+    'y2k': ".profile-page { font-family: " + FONTS['comic'] + "; }\n"
+           ".profile-page .card { border: 2px dashed #ff99cc; }\n",
+}
+
+
+def valid_color(value):
+    return bool(COLOR_RE.match(value or ''))
+
+
+def compile_css(profile):
+    color = profile.theme_color if valid_color(profile.theme_color) else DEFAULT_COLOR
+    font = FONTS.get(profile.font_choice, FONTS['default'])
+    css = f".profile-theme {{ background-color: {color}; }}\n"
+    css += f".profile-page {{ font-family: {font}; }}\n"
+    css += THEMES.get(profile.theme_choice, '')
+    if profile.background_image:
+        url = profile.background_image.url.replace('"', '%22')
+        css += (
+            f'.profile-page {{ background-image: url("{url}"); '
+            'background-size: cover; background-attachment: fixed; }\n'
+        )
+    return css
+
+
+def refresh(profile):
+    """Compile profile's theme and point it at the (possibly shared) stylesheet."""
+    css = compile_css(profile)
+    digest = hashlib.sha256(css.encode()).hexdigest()[:32]
+    sheet, _ = ThemeStylesheet.objects.get_or_create(digest=digest, defaults={'css': css})
+    old = profile.theme_stylesheet_id
+    if old != sheet.pk:
+        Profile.objects.filter(pk=profile.pk).update(theme_stylesheet=sheet)
+        profile.theme_stylesheet = sheet
+        if old:
+            ThemeStylesheet.objects.filter(pk=old, profiles__isnull=True).delete()
+    return sheet
+
+
+def stylesheet_for(profile):
+    return profile.theme_stylesheet or refresh(profile)
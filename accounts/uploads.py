@@ -0,0 +1,138 @@
+"""
+Chunked, resumable uploads.
+
+Protocol (all JSON):
+
+* ``POST /uploads/`` with target, filename, size, sha256 (and album/caption
+  for gallery images) starts an upload and returns its id and offset.
+* ``PUT /uploads/<id>/`` with an ``Upload-Offset`` header and at most
+  CHUNKED_UPLOAD_CHUNK_SIZE bytes of body appends one chunk.
+* ``GET /uploads/<id>/`` returns the current offset so a dropped client can
+  resume where the server left off.
+* ``POST /uploads/<id>/complete/`` verifies the checksum and attaches the
+  file to the gallery or profile.
+"""
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.forms import modelform_factory
+
+from . import themes
+from .forms import GalleryImageForm
+from .models import ChunkedUpload, Profile
+
+READ_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class AssembledUpload(UploadedFile):
+    """An UploadedFile backed by the finished temp file, so storage can move it instead of copying."""
+
+    def __init__(self, path, name, size, sha256):
+        super().__init__(open(path, 'rb'), name=name, size=size)
+        self.path = path
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def start(upload):
+    os.makedirs(settings.CHUNKED_UPLOAD_TEMP_DIR, exist_ok=True)
+    open(upload.temp_path(), 'wb').close()
+
+
+def write_chunk(upload, offset, length, stream):
+    """Append one chunk read from stream and return the new offset."""
+    if length is None:
+        raise UploadError("Content-Length is required.", status=411)
+    if length > settings.CHUNKED_UPLOAD_CHUNK_SIZE:
+        raise UploadError(f"Chunk too large (max {settings.CHUNKED_UPLOAD_CHUNK_SIZE} bytes).", status=413)
+    if offset != upload.offset:
+        raise UploadError(f"Expected offset {upload.offset}.", status=409)
+    if offset + length > upload.size:
+        raise UploadError("Chunk runs past the declared file size.", status=413)
+
+    written = 0
+    with open(upload.temp_path(), 'r+b') as f:
+        f.seek(offset)
+        while written < length:
+            data = stream.read(min(READ_SIZE, length - written))
+            if not data:
+                break
+            f.write(data)
+            written += len(data)
+        f.truncate()
+    if written != length:
+        raise UploadError("Chunk was shorter than Content-Length.")
+
+    # only advance if nobody else wrote this chunk meanwhile
+    new_offset = offset + written
+    if not ChunkedUpload.objects.filter(pk=upload.pk, offset=offset).update(offset=new_offset):
+        raise UploadError("Chunk was uploaded concurrently.", status=409)
+    upload.offset = new_offset
+    return new_offset
+
+
+def file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_SIZE), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def finish(upload):
+    """Verify the assembled file and attach it, returning the saved object."""
+    if upload.offset != upload.size:
+        raise UploadError(f"Upload incomplete ({upload.offset}/{upload.size} bytes).", status=409)
+    path = upload.temp_path()
+    if file_digest(path) != upload.sha256:
+        discard(upload)
+        raise UploadError("Checksum mismatch, upload discarded.", status=422)
+
+    f = AssembledUpload(path, upload.filename, upload.size, upload.sha256)
+    try:
+        profile = upload.user.profile
+        if upload.target == 'gallery':
+            form = GalleryImageForm(
+                {'album': upload.album_id or '', 'caption': upload.caption}, {'image': f}
+            )
+            form.fields['album'].queryset = profile.albums.all()
+        else:
+            form_class = modelform_factory(Profile, fields=[upload.target])
+            form = form_class({}, {upload.target: f}, instance=profile)
+        valid = form.is_valid()
+        if valid:
+            with transaction.atomic():
+                obj = form.save(commit=False)
+                if upload.target == 'gallery':
+                    obj.profile = profile
+                obj.save()
+                upload.delete()
+                if upload.target in themes.THEME_FIELDS:
+                    themes.refresh(obj)
+    finally:
+        f.close()
+    if not valid:
+        # the bytes are final, so retrying can't make them valid
+        discard(upload)
+        raise UploadError('; '.join(e for errs in form.errors.values() for e in errs), status=422)
+    # the storage moved the temp file unless an identical blob already existed
+    if os.path.exists(path):
+        os.remove(path)
+    return obj
+
+
+def discard(upload):
+    if os.path.exists(upload.temp_path()):
+        os.remove(upload.temp_path())
+    upload.delete()
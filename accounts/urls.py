@@ -15,9 +15,12 @@ urlpatterns = [
     path('dashboard/', views.dashboard, name='dashboard'),
     path('profile/', views.my_profile, name='my_profile'),
     path('profile/edit/', views.edit_profile, name='edit_profile'),
+    path('profile/delete/', views.delete_account, name='delete_account'),
+    path('profile/delete/<uuid:job_id>/', views.account_deletion_status, name='account_deletion_status'),
 
     # public profile
     path('u/<str:username>/', views.profile_view, name='profile'),
+    path('themes/<str:digest>.css', views.theme_stylesheet, name='theme_stylesheet'),
 
     # friends
     path('friend/send/<int:user_id>/', views.send_friend_request, name='send_friend_request'),
@@ -32,10 +35,15 @@ urlpatterns = [
 
     # visitors
     path('visitors/', views.visitor_log, name='visitor_log'),
+    path('visitors/analytics/', views.visitor_analytics, name='visitor_analytics'),
 
     # gallery and albums
     path('gallery/', views.gallery, name='gallery'),
     path('gallery/add/', views.add_gallery_image, name='add_gallery_image'),
+    path('gallery/add/batch/', views.add_gallery_images_batch, name='add_gallery_images_batch'),
+    path('uploads/', views.chunked_upload_start, name='chunked_upload_start'),
+    path('uploads/<uuid:upload_id>/', views.chunked_upload, name='chunked_upload'),
+    path('uploads/<uuid:upload_id>/complete/', views.chunked_upload_complete, name='chunked_upload_complete'),
     path('albums/', views.album_list, name='album_list'),
     path('albums/add/', views.album_add, name='album_add'),
 
@@ -46,4 +54,5 @@ urlpatterns = [
 
     # search
     path('search/', views.search_users, name='search'),
+    path('search/autocomplete/', views.autocomplete_users, name='autocomplete'),
 ]
@@ -1,18 +1,37 @@
+import logging
+from datetime import timedelta
+
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.http import HttpResponseForbidden
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_http_methods, require_POST
+from django.views.static import serve
+from django.utils import timezone
 
 from .forms import (
     RegisterForm, LoginForm, ProfileForm,
-    TestimonialForm, TopFiveForm, AlbumForm, GalleryImageForm
+    TestimonialForm, TopFiveForm, AlbumForm, GalleryImageForm, ChunkedUploadForm,
+    GalleryBatchUploadForm
 )
 from .models import (
     Profile, FriendRequest, Testimonial, ProfileVisit,
-    TopFive, Album, GalleryImage
+    TopFive, Album, GalleryImage, VisitSketch, ChunkedUpload, ThemeStylesheet,
+    AccountDeletion
 )
+from .hll import HyperLogLog
+from . import autocomplete, batch_upload, deletion, feed, themes, uploads
+from .privacy import can_view, visible_users, annotate_visible
+from .relationships import friend_usernames, friends_q, invalidate
+
+logger = logging.getLogger(__name__)
 
 
 def home_redirect(request):
@@ -67,23 +86,21 @@ def dashboard(request):
 
     recent_testimonials = profile.testimonials.order_by('-created_at')[:5]
 
-    # Quick friend count: accepted sent + accepted received
-    sent_accepted = FriendRequest.objects.filter(
-        from_user=request.user, accepted=True
-    ).count()
-    received_accepted = FriendRequest.objects.filter(
-        to_user=request.user, accepted=True
-    ).count()
-    friends_total = sent_accepted + received_accepted
+    # friend count is a counter cache on the profile
+    friends_total = profile.friend_count
 
-    # Simple suggestions: show some other users except the current one
-    suggestions = User.objects.exclude(id=request.user.id)[:6]
+    # Simple suggestions: other visible users who aren't friends yet
+    strangers = User.objects.exclude(friends_q(request.user.pk)).exclude(pk=request.user.pk)
+    suggestions = visible_users(
+        request.user, strangers.filter(is_active=True)
+    ).select_related('profile')[:6]
 
     return render(request, 'accounts/dashboard.html', {
         'profile': profile,
         'recent_testimonials': recent_testimonials,
         'friends_total': friends_total,
         'suggestions': suggestions,
+        'activities': feed.feed_for(request.user),
     })
 
 
@@ -97,6 +114,7 @@ def my_profile(request):
     gallery_images = profile.gallery.all().order_by('-uploaded_at')[:12]
     return render(request, 'accounts/profile.html', {
         'profile': profile,
+        'theme_stylesheet': themes.stylesheet_for(profile),
         'testimonials': testimonials,
         'hidden_testimonials': hidden_testimonials,
         'albums': albums,
@@ -110,27 +128,35 @@ def edit_profile(request):
         form = ProfileForm(request.POST, request.FILES, instance=profile)
         if form.is_valid():
             form.save()
+            if set(form.changed_data) & set(themes.THEME_FIELDS):
+                themes.refresh(profile)
             messages.success(request, 'Profile updated.')
             return redirect('accounts:my_profile')
     else:
         form = ProfileForm(instance=profile)
-    return render(request, 'accounts/edit_profile.html', {'form': form})
+    chunked_targets = [t for t in ChunkedUpload.TARGETS if t[0] != 'gallery']
+    return render(request, 'accounts/edit_profile.html', {'form': form, 'chunked_targets': chunked_targets})
 
 
 def profile_view(request, username):
-    user = get_object_or_404(User, username=username)
+    user = get_object_or_404(User, username=username, is_active=True)
     profile = user.profile
 
     # visitor recording
     if request.user.is_authenticated and request.user != user:
+        Profile.objects.filter(pk=profile.pk).update(profile_views=F('profile_views') + 1)
         profile.profile_views += 1
-        profile.save()
         ProfileVisit.objects.create(profile=profile, visitor=request.user)
+        try:
+            VisitSketch.record(profile, request.user)
+        except DatabaseError:
+            # analytics only; never fail the page over a busy database
+            logger.exception("Recording a unique visit to %s failed", user.username)
 
-    # privacy checks for simplicity: public only or owner
-    can_see_profile = (profile.profile_privacy == 'public') or (request.user == user)
-    can_see_gallery = (profile.gallery_privacy == 'public') or (request.user == user)
-    can_see_testimonials = (profile.testimonial_privacy == 'public') or (request.user == user)
+    # privacy: public, friends only (cached friend set lookup) or owner only
+    can_see_profile = can_view(request.user, profile, 'profile_privacy')
+    can_see_gallery = can_view(request.user, profile, 'gallery_privacy')
+    can_see_testimonials = can_view(request.user, profile, 'testimonial_privacy')
 
     # testimonials
     if request.user == user:
@@ -140,17 +166,12 @@ def profile_view(request, username):
         testimonials = profile.testimonials.filter(is_hidden=False)
         hidden_testimonials = profile.testimonials.none()
 
-    # mutual friends and interests simple helpers
-    def friends_of(u):
-        sent = FriendRequest.objects.filter(from_user=u, accepted=True).values_list('to_user', flat=True)
-        received = FriendRequest.objects.filter(to_user=u, accepted=True).values_list('from_user', flat=True)
-        ids = set(list(sent) + list(received))
-        return User.objects.filter(id__in=ids)
-
-    my_friends = friends_of(request.user) if request.user.is_authenticated else User.objects.none()
-    owner_friends = friends_of(user)
-
-    mutual_friends = my_friends.filter(id__in=owner_friends.values_list('id', flat=True)) if request.user.is_authenticated else []
+    # mutual friends (only listed when the owner's profile is visible) and interests
+    if request.user.is_authenticated and can_see_profile:
+        mutual = User.objects.filter(friends_q(request.user.pk), is_active=True).filter(friends_q(user.pk))
+        mutual_friends = visible_users(request.user, mutual)
+    else:
+        mutual_friends = User.objects.none()
     # mutual interests
     def mutual_interests(u1, u2):
         a = set((u1.profile.interests or '').lower().split(',')) if getattr(u1, 'profile', None) else set()
@@ -159,10 +180,11 @@ def profile_view(request, username):
         b = {s.strip() for s in b if s.strip()}
         return sorted(a & b)
 
-    mutual_interest_list = mutual_interests(request.user, user) if request.user.is_authenticated else []
+    mutual_interest_list = mutual_interests(request.user, user) if request.user.is_authenticated and can_see_profile else []
 
     return render(request, 'accounts/public_profile.html', {
         'profile': profile,
+        'theme_stylesheet': themes.stylesheet_for(profile),
         'user_obj': user,
         'can_see_profile': can_see_profile,
         'can_see_gallery': can_see_gallery,
@@ -174,6 +196,30 @@ def profile_view(request, username):
     })
 
 
+@login_required
+def delete_account(request):
+    if request.method == 'POST':
+        if request.POST.get('confirm_username') != request.user.username:
+            messages.error(request, "Type your username to confirm.")
+            return redirect('accounts:delete_account')
+        # the account is disabled now; its data is removed in the background
+        job = deletion.request_deletion(request.user)
+        logout(request)
+        return redirect('accounts:account_deletion_status', job_id=job.pk)
+    return render(request, 'accounts/delete_account.html')
+
+def account_deletion_status(request, job_id):
+    job = get_object_or_404(AccountDeletion, pk=job_id)
+    return render(request, 'accounts/account_deletion_status.html', {'job': job})
+
+def theme_stylesheet(request, digest):
+    sheet = get_object_or_404(ThemeStylesheet, digest=digest)
+    response = HttpResponse(sheet.css, content_type='text/css')
+    # the URL changes whenever the content does
+    patch_cache_control(response, public=True, max_age=31536000, immutable=True)
+    return response
+
+
 # Friends
 @login_required
 def send_friend_request(request, user_id):
@@ -191,15 +237,18 @@ def send_friend_request(request, user_id):
 @login_required
 def accept_friend_request(request, req_id):
     fr = get_object_or_404(FriendRequest, id=req_id, to_user=request.user)
-    fr.accepted = True
-    fr.save()
+    with transaction.atomic():
+        if fr.accept():
+            invalidate(fr.from_user_id, fr.to_user_id)
+            feed.publish(request.user, 'friends', fr, target_user=fr.from_user)
     messages.success(request, f"You are now friends with {fr.from_user.username}.")
     return redirect('accounts:dashboard')
 
 @login_required
 def reject_friend_request(request, req_id):
     fr = get_object_or_404(FriendRequest, id=req_id, to_user=request.user)
-    fr.delete()
+    with transaction.atomic():
+        fr.delete()
     messages.info(request, "Friend request rejected.")
     return redirect('accounts:dashboard')
 
@@ -214,7 +263,8 @@ def add_testimonial(request, username):
             t = form.save(commit=False)
             t.profile = owner.profile
             t.author = request.user
-            t.save()
+            with transaction.atomic():
+                t.save()
             messages.success(request, "Posted on their wall.")
             return redirect('accounts:profile', username=owner.username)
     else:
@@ -246,7 +296,8 @@ def delete_testimonial(request, testimonial_id):
     t = get_object_or_404(Testimonial, id=testimonial_id)
     if t.profile.user != request.user:
         return HttpResponseForbidden("Not allowed")
-    t.delete()
+    with transaction.atomic():
+        t.delete()
     messages.success(request, "Testimonial deleted.")
     return redirect('accounts:my_profile')
 
@@ -257,11 +308,44 @@ def visitor_log(request):
     visits = request.user.profile.visits.select_related('visitor')[:50]
     return render(request, 'accounts/visitor_log.html', {'visits': visits})
 
+@login_required
+def visitor_analytics(request):
+    profile = request.user.profile
+    days = 30
+    today = timezone.localdate()
+    start = today - timedelta(days=days - 1)
+
+    # at most one fixed-size sketch per day, independent of how many visits there were
+    sketches = {
+        s.day: s.sketch()
+        for s in profile.visit_sketches.filter(day__range=(start, today))
+    }
+
+    daily = []
+    for i in range(days):
+        day = start + timedelta(days=i)
+        sketch = sketches.get(day)
+        daily.append({'day': day, 'uniques': sketch.count() if sketch else 0})
+    peak = max([d['uniques'] for d in daily] + [1])
+    for d in daily:
+        d['percent'] = round(100 * d['uniques'] / peak)
+
+    week_start = today - timedelta(days=6)
+    week = HyperLogLog.union(s for day, s in sketches.items() if day >= week_start)
+    month = HyperLogLog.union(sketches.values())
+
+    return render(request, 'accounts/visitor_analytics.html', {
+        'profile': profile,
+        'daily': list(reversed(daily)),
+        'uniques_week': week.count(),
+        'uniques_month': month.count(),
+    })
+
 
 # Albums and gallery
 @login_required
 def album_list(request):
-    albums = request.user.profile.albums.all()
+    albums = request.user.profile.albums.select_related('cover')
     return render(request, 'accounts/album_list.html', {'albums': albums})
 
 @login_required
@@ -286,7 +370,8 @@ def add_gallery_image(request):
         if form.is_valid():
             gi = form.save(commit=False)
             gi.profile = request.user.profile
-            gi.save()
+            with transaction.atomic():
+                gi.save()
             messages.success(request, "Image added to your gallery.")
             return redirect('accounts:gallery')
     else:
@@ -294,12 +379,89 @@ def add_gallery_image(request):
         form.fields['album'].queryset = request.user.profile.albums.all()
     return render(request, 'accounts/add_gallery_image.html', {'form': form})
 
+@login_required
+def add_gallery_images_batch(request):
+    albums = request.user.profile.albums.all()
+    results = []
+    if request.method == 'POST':
+        form = GalleryBatchUploadForm(request.POST, request.FILES)
+        form.fields['album'].queryset = albums
+        if form.is_valid():
+            results = batch_upload.upload(
+                request.user.profile, form.cleaned_data['images'],
+                album=form.cleaned_data['album'], caption=form.cleaned_data['caption'],
+            )
+            ok = sum(r['ok'] for r in results)
+            if ok:
+                messages.success(request, f"{ok} image{'s' if ok != 1 else ''} added to your gallery.")
+            if ok < len(results):
+                messages.error(request, f"{len(results) - ok} file{'s' if len(results) - ok != 1 else ''} could not be added.")
+    else:
+        form = GalleryBatchUploadForm()
+        form.fields['album'].queryset = albums
+    return render(request, 'accounts/add_gallery_images_batch.html', {'form': form, 'results': results})
+
 @login_required
 def gallery(request):
     images = request.user.profile.gallery.all().order_by('-uploaded_at')
     return render(request, 'accounts/gallery.html', {'gallery': images})
 
 
+# Chunked uploads (protocol described in accounts/uploads.py)
+def _upload_state(upload):
+    return {'id': str(upload.pk), 'offset': upload.offset, 'size': upload.size,
+            'chunk_size': settings.CHUNKED_UPLOAD_CHUNK_SIZE}
+
+@login_required
+@require_POST
+def chunked_upload_start(request):
+    form = ChunkedUploadForm(request.POST)
+    form.fields['album'].queryset = request.user.profile.albums.all()
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    upload = form.save(commit=False)
+    upload.user = request.user
+    upload.save()
+    uploads.start(upload)
+    return JsonResponse(_upload_state(upload), status=201)
+
+@login_required
+@require_http_methods(['GET', 'PUT', 'DELETE'])
+def chunked_upload(request, upload_id):
+    upload = get_object_or_404(ChunkedUpload, pk=upload_id, user=request.user)
+    if request.method == 'DELETE':
+        uploads.discard(upload)
+        return JsonResponse({'id': str(upload_id), 'deleted': True})
+    if request.method == 'PUT':
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+            length = request.headers.get('Content-Length')
+            # a missing length is left to write_chunk, which answers 411
+            length = int(length) if length else None
+        except ValueError:
+            return JsonResponse({'error': "Upload-Offset and Content-Length must be integers."}, status=400)
+        try:
+            # read straight from the request stream so a chunk never sits in memory whole
+            uploads.write_chunk(upload, offset, length, request)
+        except uploads.UploadError as e:
+            return JsonResponse({'error': str(e), **_upload_state(upload)}, status=e.status)
+    return JsonResponse(_upload_state(upload))
+
+@login_required
+@require_POST
+def chunked_upload_complete(request, upload_id):
+    upload = get_object_or_404(ChunkedUpload, pk=upload_id, user=request.user)
+    try:
+        obj = uploads.finish(upload)
+    except uploads.UploadError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+    if upload.target == 'gallery':
+        url = obj.image.url
+    else:
+        url = getattr(obj, upload.target).url
+    return JsonResponse({'target': upload.target, 'url': url})
+
+
 # Top five
 @login_required
 def topfive_list(request):
@@ -334,6 +496,37 @@ def search_users(request):
     q = request.GET.get('q', '')
     results = []
     if q:
-        results = User.objects.filter(username__icontains=q) | User.objects.filter(profile__interests__icontains=q)
-        results = results.distinct()
+        # interests are part of the profile section, so only match them where it is visible
+        by_interest = visible_users(request.user, User.objects.filter(profile__interests__icontains=q))
+        results = User.objects.filter(username__icontains=q) | by_interest
+        results = results.filter(is_active=True).distinct()
+        results = annotate_visible(request.user, results).select_related('profile')
     return render(request, 'accounts/search.html', {'query': q, 'results': results})
+
+@login_required
+def autocomplete_users(request):
+    q = request.GET.get('q', '').strip()[:150]
+    limit = 10
+    if not q:
+        return JsonResponse({'results': []})
+    prefix = q.lower()
+    # friends first, then everyone else by profile views
+    friends = sorted(
+        (name for name in friend_usernames(request.user.pk).values() if name.lower().startswith(prefix)),
+        key=str.lower,
+    )[:limit]
+    names = friends + [
+        name for _, name in autocomplete.complete(prefix, limit + len(friends))
+        if name not in friends
+    ]
+    return JsonResponse({'results': [
+        {'username': name, 'url': reverse('accounts:profile', args=[name]), 'friend': name in friends}
+        for name in names[:limit]
+    ]})
+
+# Media (development server only)
+def serve_blob(request, path, document_root=None):
+    # blob names are content hashes, so the response can be cached forever
+    response = serve(request, path, document_root=document_root)
+    patch_cache_control(response, public=True, max_age=31536000, immutable=True)
+    return response
@@ -0,0 +1,27 @@
+// Username type-ahead for the navbar search box (accounts.views.autocomplete_users).
+(function () {
+  const input = document.querySelector('input[data-autocomplete-url]');
+  if (!input) return;
+  const list = document.getElementById(input.getAttribute('list'));
+  let timer = null;
+  let latest = 0;
+
+  input.addEventListener('input', () => {
+    clearTimeout(timer);
+    timer = setTimeout(async () => {
+      const q = input.value.trim();
+      const seq = ++latest;
+      if (!q) { list.innerHTML = ''; return; }
+      const response = await fetch(input.dataset.autocompleteUrl + '?q=' + encodeURIComponent(q),
+                                   {credentials: 'same-origin'});
+      if (!response.ok || seq !== latest) return;
+      const data = await response.json();
+      list.innerHTML = '';
+      data.results.forEach(r => {
+        const option = document.createElement('option');
+        option.value = r.username;
+        list.appendChild(option);
+      });
+    }, 100);
+  });
+})();
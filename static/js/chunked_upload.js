@@ -0,0 +1,73 @@
+// Resumable chunked uploads, see accounts/uploads.py for the protocol.
+// Any <form data-chunked-upload="target"> with a file input is uploaded in
+// chunks instead of a single multipart POST.
+(function () {
+  function csrfToken() {
+    const match = document.cookie.match(/(?:^|;\s*)csrftoken=([^;]+)/);
+    return match ? decodeURIComponent(match[1]) : '';
+  }
+
+  async function sha256(file) {
+    const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+  }
+
+  // conflictOk: a 409 on PUT carries the server's offset to resync from;
+  // anywhere else (e.g. completing an incomplete upload) it is an error
+  async function request(url, options, conflictOk) {
+    const response = await fetch(url, Object.assign({credentials: 'same-origin'}, options));
+    const body = await response.json();
+    if (!response.ok && !(conflictOk && response.status === 409)) {
+      throw new Error(body.error || JSON.stringify(body.errors));
+    }
+    return body;
+  }
+
+  async function upload(form, file, status) {
+    const headers = {'X-CSRFToken': csrfToken()};
+    const data = new FormData();
+    data.append('target', form.dataset.chunkedUpload);
+    data.append('filename', file.name);
+    data.append('size', file.size);
+    data.append('sha256', await sha256(file));
+    ['album', 'caption'].forEach(name => {
+      if (form.elements[name]) data.append(name, form.elements[name].value);
+    });
+    let state = await request(form.dataset.startUrl, {method: 'POST', headers, body: data});
+    const url = form.dataset.startUrl + state.id + '/';
+
+    let retries = 0;
+    while (state.offset < state.size) {
+      const chunk = file.slice(state.offset, state.offset + state.chunk_size);
+      try {
+        state = await request(url, {
+          method: 'PUT',
+          headers: Object.assign({'Upload-Offset': state.offset}, headers),
+          body: chunk,
+        }, true);
+        retries = 0;
+      } catch (e) {
+        if (++retries > 5) throw e;
+        // resume from whatever the server actually has
+        state = await request(url, {method: 'GET'});
+      }
+      status.textContent = Math.round(100 * state.offset / state.size) + '%';
+    }
+    return request(url + 'complete/', {method: 'POST', headers});
+  }
+
+  document.querySelectorAll('form[data-chunked-upload]').forEach(form => {
+    const status = form.querySelector('[data-upload-status]');
+    form.addEventListener('submit', async event => {
+      event.preventDefault();
+      const file = form.querySelector('input[type=file]').files[0];
+      if (!file) return;
+      try {
+        await upload(form, file, status);
+        window.location = form.dataset.nextUrl;
+      } catch (e) {
+        status.textContent = e.message;
+      }
+    });
+  });
+})();